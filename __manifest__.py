@@ -45,6 +45,7 @@
         'security/security.xml',
         'security/ir.model.access.csv',
         'data/data.xml',
+        'data/ir_cron_data.xml',
         'views/config/res_company.xml',
         'views/config/res_config_settings_views.xml',
         'views/config/resolution_views.xml',
@@ -55,6 +56,8 @@
         'views/account_invoice_view.xml',
         'views/res_partner_view.xml',
         'views/mail_message_views.xml',
+        'views/submission_views.xml',
+        'views/mail_submission_views.xml',
         'report/report_invoice.xml',
         'data/mail_template_data.xml',
     ],
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+#
+# Jorels S.A.S. - Copyright (2019-2021)
+#
+# This file is part of l10n_co_edi_jorels.
+#
+# l10n_co_edi_jorels is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# l10n_co_edi_jorels is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with l10n_co_edi_jorels.  If not, see <https://www.gnu.org/licenses/>.
+#
+# email: info@jorels.com
+#
+
+"""Microbenchmarks of the construction of the json payload sent to the API.
+
+Synthetic copies of a template invoice are built with 1, 100, 1000 and 10000 lines and several tax mixes. For
+each payload method it records the wall time (best of --repeat runs), the tracemalloc peak and the SQL queries,
+always with cold caches. The results can be saved as a baseline, later runs fail when they regress beyond the
+threshold. The changes are rolled back at the end.
+
+Usage::
+
+    python benchmarks/bench_payload.py -c odoo.conf -d db --template 42 --save-baseline baseline.json
+    python benchmarks/bench_payload.py -c odoo.conf -d db --template 42 --baseline baseline.json
+"""
+
+import json
+import logging
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import Measure, get_parser, odoo_environment  # noqa: E402
+
+_logger = logging.getLogger(__name__)
+
+METHODS = ('get_json_request', 'get_ei_customer', 'get_ei_lines', 'get_ei_legal_monetary_totals')
+
+# Holgura absoluta de cada métrica, para que el ruido de las mediciones pequeñas no se tome como regresión
+SLACK = {'time_ms': 5.0, 'peak_kb': 64.0, 'queries': 0}
+
+
+def get_tax_mixes(env, company):
+    """Return {name: [taxes of each line, cycled]} with the tax combinations available in the company"""
+    taxes = env['account.tax'].search([
+        ('company_id', '=', company.id),
+        ('type_tax_use', '=', 'sale'),
+        ('edi_tax_id', '!=', False),
+    ])
+    mixes = {'no_taxes': [taxes.browse()]}
+    percent = taxes.filtered(lambda tax: tax.amount_type == 'percent' and tax.edi_tax_id.name[:4] != 'Rete')
+    if percent:
+        mixes['single_tax'] = [percent[0]]
+    if len(taxes) > 1:
+        # Cada línea con un impuesto distinto, y algunas con todos, incluidas las retenciones
+        mixes['mixed_taxes'] = [tax for tax in taxes] + [taxes]
+    return mixes
+
+
+def build_invoice(template, size, tax_mix):
+    """Return a draft copy of the template invoice with size lines, cycling through the taxes of tax_mix"""
+    line = template.invoice_line_ids[:1]
+    lines = []
+    for i in range(size):
+        lines.append((0, 0, {
+            'product_id': line.product_id.id,
+            'name': '%s %s' % (line.name, i),
+            'account_id': line.account_id.id,
+            'uom_id': line.uom_id.id,
+            'quantity': 1 + i % 7,
+            'price_unit': 1000.0 + i % 100,
+            # Una de cada diez líneas con descuento
+            'discount': 10.0 if i % 10 == 9 else 0.0,
+            'invoice_line_tax_ids': [(6, 0, tax_mix[i % len(tax_mix)].ids)],
+        }))
+    invoice = template.copy({'invoice_line_ids': lines})
+    invoice.compute_taxes()
+    # Las copias quedan en borrador, sin número; el json lo necesita y validarlas llamaría a la API
+    env = invoice.env
+    env.cr.execute("UPDATE account_invoice SET number = %s WHERE id = %s", ('BENCH%d' % invoice.id, invoice.id))
+    invoice.invalidate_cache(['number'])
+    return invoice
+
+
+def measure(env, invoice, method, repeat):
+    """Return the best wall time, the memory peak and the queries of a payload method, with cold caches"""
+
+    def run():
+        env.invalidate_all()
+        invoice._invalidate_json_request()
+        with Measure(env.cr) as result:
+            getattr(invoice, method)()
+        return result
+
+    runs = [run() for i in range(repeat)]
+
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'time_ms': min(result.elapsed for result in runs) * 1000,
+        'peak_kb': peak / 1024.0,
+        'queries': runs[0].queries,
+    }
+
+
+def compare(results, baseline, threshold):
+    """Return the regressions of the results against the baseline, as readable lines"""
+    regressions = []
+    for key, metrics in sorted(results.items()):
+        if key not in baseline:
+            continue
+        for metric, value in sorted(metrics.items()):
+            reference = baseline[key].get(metric)
+            if reference is not None and value > reference * (1 + threshold) + SLACK[metric]:
+                regressions.append("%s %s: %.1f -> %.1f (+%.0f%%)" % (
+                    key, metric, reference, value, (value / reference - 1) * 100 if reference else 100))
+    return regressions
+
+
+def main():
+    parser = get_parser("Rendimiento de la construcción del json de las facturas")
+    parser.add_argument('--template', type=int, required=True, help="Id de la factura que se copia")
+    parser.add_argument('--sizes', default='1,100,1000,10000', help="Número de líneas, separados por comas")
+    parser.add_argument('--repeat', type=int, default=3, help="Mediciones de tiempo por método")
+    parser.add_argument('--baseline', help="Json con los resultados de referencia")
+    parser.add_argument('--save-baseline', help="Guardar los resultados en este json")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="Aumento relativo a partir del cual hay regresión, por defecto 0.2 (20%%)")
+    options = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    results = {}
+    with odoo_environment(options) as env:
+        template = env['account.invoice'].browse(options.template)
+        for mix_name, tax_mix in sorted(get_tax_mixes(env, template.company_id).items()):
+            for size in [int(size) for size in options.sizes.split(',')]:
+                _logger.info("Factura de %s líneas, %s", size, mix_name)
+                invoice = build_invoice(template, size, tax_mix)
+                for method in METHODS:
+                    key = '%s/%s/%s' % (mix_name, size, method)
+                    results[key] = measure(env, invoice, method, options.repeat)
+                    print("%-50s %10.1f ms %10.1f KB %6d queries" % (
+                        key, results[key]['time_ms'], results[key]['peak_kb'], results[key]['queries']))
+
+    if options.save_baseline:
+        with open(options.save_baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+
+    if options.baseline:
+        with open(options.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), options.threshold)
+        if regressions:
+            print("\nRegresiones:\n" + "\n".join(regressions))
+            sys.exit(1)
+        print("\nSin regresiones frente a %s" % options.baseline)
+
+
+if __name__ == '__main__':
+    main()
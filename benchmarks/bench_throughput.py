@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+#
+# Jorels S.A.S. - Copyright (2019-2021)
+#
+# This file is part of l10n_co_edi_jorels.
+#
+# l10n_co_edi_jorels is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# l10n_co_edi_jorels is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with l10n_co_edi_jorels.  If not, see <https://www.gnu.org/licenses/>.
+#
+# email: info@jorels.com
+#
+
+"""End-to-end throughput of the electronic invoicing against the local stub of the API.
+
+Copies of a template invoice, one that validates in the database, are opened with action_invoice_open and then
+sent again with validate_dian_generic. For each step it reports invoices per second, p50/p99 latency and SQL
+queries per invoice. The changes are rolled back at the end.
+
+Usage::
+
+    python benchmarks/bench_throughput.py -c odoo.conf -d db --template 42 --count 200 --latency 300 --jitter 100
+"""
+
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import stub_api  # noqa: E402
+from common import Measure, get_parser, odoo_environment, percentile  # noqa: E402
+
+_logger = logging.getLogger(__name__)
+
+
+def run_step(env, name, invoices, method):
+    """Call method on each invoice and return the statistics of the step"""
+    latencies = []
+    queries = 0
+    failures = 0
+    with Measure(env.cr) as total:
+        for invoice in invoices:
+            with Measure(env.cr) as measure:
+                try:
+                    with env.cr.savepoint():
+                        method(invoice)
+                except Exception as e:
+                    failures += 1
+                    _logger.debug("%s %s: %s", name, invoice.id, e)
+            latencies.append(measure.elapsed)
+            queries += measure.queries
+    count = len(invoices) or 1
+    return {
+        'step': name,
+        'invoices': len(invoices),
+        'failures': failures,
+        'invoices_per_second': len(invoices) / total.elapsed if total.elapsed else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'queries_per_invoice': queries / float(count),
+    }
+
+
+def main():
+    parser = get_parser("Rendimiento de la validación de facturas contra la API de pruebas")
+    parser.add_argument('--template', type=int, required=True, help="Id de la factura que se copia")
+    parser.add_argument('--count', type=int, default=100, help="Número de facturas")
+    parser.add_argument('--api-url', help="Url de una API de pruebas ya iniciada, por defecto se inicia una")
+    stub_api.add_arguments(parser)
+    options = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    api_url = options.api_url
+    if not api_url:
+        options.host, options.port = '127.0.0.1', 0
+        server = stub_api.start_server(options)
+        api_url = 'http://127.0.0.1:%s' % server.server_port
+
+    with odoo_environment(options) as env:
+        template = env['account.invoice'].browse(options.template)
+        template.company_id.write({
+            'api_url': api_url,
+            'api_key': template.company_id.api_key or 'benchmark',
+            'is_not_test': True,
+            'enable_validate_state': False,
+            'ei_async_validation': False,
+            'enable_mass_send_print': False,
+        })
+        invoices = env['account.invoice'].browse()
+        for i in range(options.count):
+            invoices |= template.copy()
+
+        results = [
+            run_step(env, 'action_invoice_open', invoices, lambda inv: inv.action_invoice_open()),
+            run_step(env, 'validate_dian_generic', invoices.filtered(lambda inv: inv.state == 'open'),
+                     lambda inv: inv.validate_dian_generic(False)),
+        ]
+
+    print("%-22s %8s %8s %10s %10s %10s %10s" % (
+        'step', 'invoices', 'failures', 'inv/s', 'p50 ms', 'p99 ms', 'queries'))
+    for result in results:
+        print("%(step)-22s %(invoices)8d %(failures)8d %(invoices_per_second)10.2f %(p50_ms)10.1f "
+              "%(p99_ms)10.1f %(queries_per_invoice)10.1f" % result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+#
+# Jorels S.A.S. - Copyright (2019-2021)
+#
+# This file is part of l10n_co_edi_jorels.
+#
+# l10n_co_edi_jorels is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# l10n_co_edi_jorels is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with l10n_co_edi_jorels.  If not, see <https://www.gnu.org/licenses/>.
+#
+# email: info@jorels.com
+#
+
+"""Helpers shared by the benchmarks: Odoo environment, timing and SQL query counts"""
+
+import argparse
+import contextlib
+import time
+
+import odoo
+from odoo import SUPERUSER_ID, api
+
+
+def get_parser(description):
+    """Return an argument parser with the options to connect to the Odoo database"""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('-c', '--config', help="Archivo de configuración de Odoo")
+    parser.add_argument('-d', '--database', required=True, help="Base de datos con el módulo instalado")
+    parser.add_argument('--commit', action='store_true',
+                        help="Guardar los cambios, por defecto se deshacen al terminar")
+    return parser
+
+
+@contextlib.contextmanager
+def odoo_environment(options):
+    """Yield a superuser environment on the database, its changes are rolled back unless --commit is given"""
+    odoo.tools.config.parse_config(['-c', options.config] if options.config else [])
+    registry = odoo.registry(options.database)
+    with api.Environment.manage(), registry.cursor() as cr:
+        try:
+            yield api.Environment(cr, SUPERUSER_ID, {})
+        finally:
+            if options.commit:
+                cr.commit()
+            else:
+                cr.rollback()
+
+
+class Measure(object):
+    """Wall time and number of SQL queries of a block of code.
+
+    Usage::
+
+        with Measure(env.cr) as measure:
+            invoice.action_invoice_open()
+        print(measure.elapsed, measure.queries)
+    """
+
+    def __init__(self, cr):
+        self.cr = cr
+        self.elapsed = 0.0
+        self.queries = 0
+
+    def __enter__(self):
+        self._queries = self.cr.sql_log_count
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.perf_counter() - self._start
+        self.queries = self.cr.sql_log_count - self._queries
+
+
+def percentile(values, percent):
+    """Return the percentile of the values, with linear interpolation between the closest ranks"""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = (len(values) - 1) * percent / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+#
+# Jorels S.A.S. - Copyright (2019-2021)
+#
+# This file is part of l10n_co_edi_jorels.
+#
+# l10n_co_edi_jorels is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# l10n_co_edi_jorels is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with l10n_co_edi_jorels.  If not, see <https://www.gnu.org/licenses/>.
+#
+# email: info@jorels.com
+#
+
+"""Local stand-in of the Jorels API for load tests.
+
+It answers the endpoints used by the module with well formed documents, without contacting the DIAN. The latency
+and the failures of each response can be configured to see how the module behaves under a slow or unstable API.
+
+Usage::
+
+    python benchmarks/stub_api.py --port 8089 --latency 300 --jitter 100 --error-rate 0.05
+
+Then set http://127.0.0.1:8089 as the Api url of the company.
+"""
+
+import argparse
+import base64
+import hashlib
+import itertools
+import json
+import logging
+import random
+import re
+import socketserver
+import threading
+import time
+import uuid
+from datetime import date
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+_logger = logging.getLogger(__name__)
+
+PREFIX = '/api/ubl2.1'
+
+ATTACHED_DOCUMENT = """<?xml version="1.0" encoding="UTF-8"?>
+<AttachedDocument xmlns="urn:oasis:names:specification:ubl:schema:xsd:AttachedDocument-2"
+    xmlns:cac="urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2"
+    xmlns:cbc="urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2">
+  <cbc:ParentDocumentID>{number}</cbc:ParentDocumentID>
+  <cac:ParentDocumentLineReference>
+    <cac:DocumentReference>
+      <cbc:UUID>{cufe}</cbc:UUID>
+      <cac:ResultOfVerification>
+        <cbc:ValidationResultCode>02</cbc:ValidationResultCode>
+      </cac:ResultOfVerification>
+    </cac:DocumentReference>
+  </cac:ParentDocumentLineReference>
+</AttachedDocument>
+"""
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    """One thread per request, http.server only provides it from Python 3.7"""
+    daemon_threads = True
+
+
+class StubState(object):
+    """Documents, resolutions and environment kept in memory by the stub"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.documents = {}
+        self.resolutions = {}
+        self.environment = 2
+        self._resolution_ids = itertools.count(1)
+
+    def add_document(self, type_edi_document, data):
+        number = str(data.get('number', ''))
+        resolution = self.resolutions.get(data.get('resolution_id'), {})
+        cufe = hashlib.sha384(uuid.uuid4().bytes).hexdigest()
+        zip_key = str(uuid.uuid4())
+        attached_document = ATTACHED_DOCUMENT.format(number=(resolution.get('prefix') or '') + number, cufe=cufe)
+        document = {
+            'is_valid': True,
+            'algorithm': 'CUFE-SHA384',
+            'uuid': cufe,
+            'issue_date': date.today().isoformat(),
+            'zip_key': zip_key,
+            'status_code': '00',
+            'status_description': 'Procesado Correctamente.',
+            'status_message': 'La %s %s, ha sido autorizada.' % (type_edi_document, number),
+            'xml_name': 'fv%s.xml' % number,
+            'zip_name': 'z%s.zip' % number,
+            'xml_base64_bytes': _b64('<Invoice>%s</Invoice>' % number),
+            'qr_data': 'NumFac: %s\nCUFE: %s' % (number, cufe),
+            'application_response_base64_bytes': _b64('<ApplicationResponse/>'),
+            'attached_document_base64_bytes': _b64(attached_document),
+            'pdf_base64_bytes': _b64('%PDF-1.4\n%%EOF\n'),
+            'zip_base64_bytes': _b64('PK'),
+            'signature': base64.b64encode(hashlib.sha256(cufe.encode()).digest()).decode(),
+            'errors_messages': [],
+        }
+        with self.lock:
+            self.documents[cufe] = document
+        return document
+
+    def add_resolution(self, data, resolution_id=None):
+        with self.lock:
+            if resolution_id is None:
+                resolution_id = next(self._resolution_ids)
+            resolution = dict(self.resolutions.get(resolution_id, {}), **data)
+            resolution.update({
+                'id': resolution_id,
+                'number': resolution.get('number') or resolution.get('from'),
+                'next_consecutive': str(resolution.get('from') or 1),
+            })
+            self.resolutions[resolution_id] = resolution
+        return resolution
+
+
+def _b64(text):
+    return base64.b64encode(text.encode()).decode()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Route the requests of the module to the in-memory state of the server"""
+
+    routes = [
+        ('POST', re.compile(r'/(invoice|credit-note|debit-note)(/[^/]+)?$'), 'document'),
+        ('POST', re.compile(r'/status/document/([^/]+)$'), 'status'),
+        ('POST', re.compile(r'/logs/([^/]+)$'), 'logs'),
+        ('GET', re.compile(r'/config/resolutions$'), 'resolutions'),
+        ('POST', re.compile(r'/config/resolution$'), 'resolution_create'),
+        ('PUT', re.compile(r'/config/resolution/(\d+)$'), 'resolution_update'),
+        ('DELETE', re.compile(r'/config/resolution/(\d+)$'), 'resolution_delete'),
+        ('GET', re.compile(r'/config/environment$'), 'environment'),
+        ('PUT', re.compile(r'/config/environment$'), 'environment_update'),
+    ]
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def log_message(self, format, *args):
+        _logger.debug(format, *args)
+
+    def _dispatch(self, method):
+        options = self.server.options
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+
+        delay = max(0.0, random.gauss(options.latency, options.jitter)) / 1000.0
+        time.sleep(delay)
+
+        if not self.headers.get('Authorization', '').startswith('Bearer ') or \
+                self.headers['Authorization'] == 'Bearer ':
+            return self._reply(401, {'message': 'Unauthenticated.'})
+        if random.random() < options.error_rate:
+            return self._reply(options.error_status, {'message': 'Error simulado por el servidor de pruebas'})
+
+        path = self.path.split('?')[0]
+        if path.startswith(PREFIX):
+            path = path[len(PREFIX):]
+        for route_method, pattern, name in self.routes:
+            match = pattern.match(path)
+            if route_method == method and match:
+                data = json.loads(body.decode() or 'null') or {}
+                status, response = getattr(self, '_' + name)(data, *match.groups())
+                return self._reply(status, response)
+        return self._reply(404, {'message': 'Ruta no encontrada: %s %s' % (method, self.path)})
+
+    def _reply(self, status, response):
+        content = json.dumps(response).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    # Endpoints
+
+    def _document(self, data, type_edi_document, test_set_id=None):
+        return 200, self.server.state.add_document(type_edi_document, data)
+
+    def _status(self, data, cufe):
+        document = self.server.state.documents.get(cufe)
+        if document is None:
+            return 404, {'message': 'No se encontró el documento %s' % cufe}
+        return 200, document
+
+    def _logs(self, data, cufe):
+        document = self.server.state.documents.get(cufe)
+        if document is None:
+            return 200, []
+        return 200, [dict(document, id=1)]
+
+    def _resolutions(self, data):
+        return 200, list(self.server.state.resolutions.values())
+
+    def _resolution_create(self, data):
+        return 200, {'message': 'Resolución creada con éxito',
+                     'resolution': self.server.state.add_resolution(data)}
+
+    def _resolution_update(self, data, resolution_id):
+        return 200, {'message': 'Resolución actualizada con éxito',
+                     'resolution': self.server.state.add_resolution(data, int(resolution_id))}
+
+    def _resolution_delete(self, data, resolution_id):
+        with self.server.state.lock:
+            self.server.state.resolutions.pop(int(resolution_id), None)
+        return 200, {'message': 'Resolución eliminada con éxito'}
+
+    def _environment(self, data):
+        return 200, {'type_environment_id': self.server.state.environment}
+
+    def _environment_update(self, data):
+        self.server.state.environment = data.get('type_environment_id', self.server.state.environment)
+        return 200, {'message': 'Entorno actualizado con éxito',
+                     'type_environment_id': self.server.state.environment}
+
+
+def add_arguments(parser):
+    """Add the latency and error injection options of the stub to an argument parser"""
+    parser.add_argument('--latency', type=float, default=0, help="Latencia media de las respuestas, en ms")
+    parser.add_argument('--jitter', type=float, default=0, help="Desviación estándar de la latencia, en ms")
+    parser.add_argument('--error-rate', type=float, default=0, help="Fracción de respuestas con error, de 0 a 1")
+    parser.add_argument('--error-status', type=int, default=503, help="Código HTTP de las respuestas con error")
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Servidor local que simula la API de Jorels")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    add_arguments(parser)
+    return parser
+
+
+def start_server(options):
+    """Start the stub in a daemon thread and return the server, its url is http://<host>:<server_port>"""
+    server = ThreadingHTTPServer((options.host, options.port), StubHandler)
+    server.options = options
+    server.state = StubState()
+    # Resolución por defecto, para las facturas que aún no se han sincronizado con el stub
+    server.state.add_resolution({'type_document_id': 1, 'prefix': '', 'from': 1, 'to': 1000000})
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    options = get_parser().parse_args()
+    server = start_server(options)
+    _logger.info("API de pruebas en http://%s:%s", options.host, server.server_port)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -26,3 +26,6 @@ from . import account_invoice
 from . import res_partner
 from . import mail_template
 from . import mail_message
+from . import submission
+from . import mail_submission
+from . import ir_actions_report
@@ -21,19 +21,128 @@
 #
 
 import base64
+import copy
 import json
 import logging
 import math
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
 from io import BytesIO
+from weakref import WeakKeyDictionary
 
 import qrcode
-import requests
+from lxml import etree
 from num2words import num2words
-from odoo import api, fields, models
+from odoo import api, fields, models, tools
 from odoo.exceptions import Warning
 
+from ..tools import jorels_api
+
 _logger = logging.getLogger(__name__)
 
+# Json requests already built in a transaction: {cursor: {invoice_id: ((write_date, uid, context), json_request)}}
+_JSON_REQUEST_CACHE = WeakKeyDictionary()
+
+# Invoices referenced by the origin of the notes in a transaction: {cursor: {(company_id, number): invoice_id}}
+_ORIGIN_INVOICE_CACHE = WeakKeyDictionary()
+
+# Consulta periodica del estado de los documentos sin respuesta completa de la DIAN.
+# El intervalo (minutos) se duplica con cada consulta, hasta el maximo, y se desiste tras POLL_MAX_COUNT consultas.
+POLL_INTERVAL_MIN = 1
+POLL_INTERVAL_MAX = 360
+POLL_MAX_COUNT = 15
+
+# Lado en pixeles del QR en la representación gráfica, la imagen se genera a ese tamaño para que no se escale
+QR_IMAGE_SIZE = 192
+
+
+def _run_concurrently(calls, max_workers):
+    """Run the API calls in a thread pool.
+
+    :param calls: dict {key: (function, args)}, the functions must not use the ORM
+    :return: generator of (key, result, exception) in completion order
+    """
+    with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+        futures = {executor.submit(function, *args): key for key, (function, args) in calls.items()}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], None, e
+
+
+# Bytes leidos por vez al buscar en los archivos del filestore
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def _stream_contains(stream, needle, stop=None, chunk_size=STREAM_CHUNK_SIZE):
+    """Look for needle in a binary stream reading it by chunks.
+
+    It stops as soon as needle is found or, if given, once the stop bytes were read without finding it.
+    """
+    keep = max(len(needle), len(stop or b'')) - 1
+    tail = b''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return False
+        data = tail + chunk
+        if needle in data:
+            return True
+        if stop and stop in data:
+            return False
+        # Se conserva el final por si needle o stop quedan partidos entre dos bloques
+        tail = data[-keep:] if keep > 0 else b''
+
+
+UBL_NAMESPACES = {
+    'cac': 'urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2',
+    'cbc': 'urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2',
+}
+
+
+def _parse_embedded_xml(root, path):
+    """Parse the XML document embedded as text in the element found at path, None if there is none"""
+    text = root.findtext(path, namespaces=UBL_NAMESPACES)
+    if not text or not text.strip():
+        return None
+    return etree.fromstring(text.strip().encode(), parser=etree.XMLParser(resolve_entities=False, huge_tree=True))
+
+
+def _parse_attached_document(stream):
+    """Extract the DIAN data of an AttachedDocument.
+
+    :return: dict with the values of the ei_attached_* fields
+    """
+    root = etree.parse(stream, parser=etree.XMLParser(resolve_entities=False, huge_tree=True)).getroot()
+    reference = 'cac:ParentDocumentLineReference/cac:DocumentReference/'
+    vals = {
+        'ei_attached_parent_document_id': root.findtext('cbc:ParentDocumentID', namespaces=UBL_NAMESPACES),
+        'ei_attached_cufe': root.findtext(reference + 'cbc:UUID', namespaces=UBL_NAMESPACES),
+        'ei_attached_response_code': root.findtext(reference + 'cac:ResultOfVerification/cbc:ValidationResultCode',
+                                                   namespaces=UBL_NAMESPACES),
+    }
+
+    # Factura, nota crédito o nota débito enviada
+    document = _parse_embedded_xml(root, 'cac:Attachment/cac:ExternalReference/cbc:Description')
+    if document is not None:
+        vals['ei_attached_cufe'] = document.findtext('cbc:UUID', namespaces=UBL_NAMESPACES) or vals['ei_attached_cufe']
+        vals['ei_attached_issue_date'] = document.findtext('cbc:IssueDate', namespaces=UBL_NAMESPACES)
+        amount = document.findtext('cac:LegalMonetaryTotal/cbc:PayableAmount', namespaces=UBL_NAMESPACES) or \
+            document.findtext('cac:RequestedMonetaryTotal/cbc:PayableAmount', namespaces=UBL_NAMESPACES)
+        if amount:
+            vals['ei_attached_payable_amount'] = float(amount)
+
+    # Respuesta de la DIAN
+    response = _parse_embedded_xml(root, reference + 'cac:Attachment/cac:ExternalReference/cbc:Description')
+    if response is not None:
+        vals['ei_attached_response_code'] = response.findtext(
+            'cac:DocumentResponse/cac:Response/cbc:ResponseCode', namespaces=UBL_NAMESPACES) or \
+            vals['ei_attached_response_code']
+
+    return {key: value.strip() if isinstance(value, str) else value for key, value in vals.items()}
+
 
 class AccountInvoice(models.Model):
     _inherit = "account.invoice"
@@ -77,11 +186,16 @@ class AccountInvoice(models.Model):
     ei_dian_response_base64_bytes = fields.Binary('Respuesta de la DIAN', attachment=True, copy=False)
 
     ei_attached_zip_base64_bytes = fields.Binary('Zip adjunto', attachment=True, copy=False)
+    ei_attached_zip_checksum = fields.Char(string="Checksum del zip adjunto", copy=False)
     ei_xml_base64_bytes = fields.Binary('XML', attachment=True, copy=False)
     ei_signature = fields.Char(string="Signature", copy=False)
 
-    # QR image
-    ei_qr_image = fields.Binary("QR Code", attachment=True, copy=False)
+    # QR image, se genera al consultarla a partir de ei_qr_data
+    ei_qr_image = fields.Binary("QR Code", compute="_compute_ei_qr_image")
+
+    # Consulta periodica del estado en la DIAN
+    ei_poll_count = fields.Integer(string="Consultas de estado", copy=False)
+    ei_poll_next_date = fields.Datetime(string="Próxima consulta de estado", copy=False, index=True)
 
     # Total de impuestos solo/sin retenciones
     ei_amount_tax_withholding = fields.Monetary("Retenciones", compute="_compute_amount", store=True)
@@ -109,6 +223,14 @@ class AccountInvoice(models.Model):
 
     is_attached_document_matched = fields.Boolean("¿Número correcto en documento adjunto?", copy=False,
                                                   compute='_is_attached_document_matched', store=True)
+    # Datos del documento adjunto, extraídos al recibirlo
+    ei_attached_cufe = fields.Char(string="CUFE/CUDE", copy=False, readonly=True, index=True)
+    ei_attached_issue_date = fields.Date(string="Fecha de emisión DIAN", copy=False, readonly=True, index=True)
+    ei_attached_payable_amount = fields.Monetary(string="Total a pagar DIAN", copy=False, readonly=True)
+    ei_attached_parent_document_id = fields.Char(string="Número en documento adjunto", copy=False, readonly=True,
+                                                 index=True)
+    ei_attached_response_code = fields.Char(string="Código de respuesta DIAN", copy=False, readonly=True, index=True)
+
     # DIAN events
     event = fields.Selection([
         ('none', 'None'),
@@ -117,51 +239,172 @@ class AccountInvoice(models.Model):
         ('acceptance', 'Express acceptance of document'),
     ], string="Event", default='none', copy=False, readonly=True, required=True)
 
+    # Campos escritos con la respuesta de la API o su consulta, no modifican la petición enviada
+    _ei_response_fields = {
+        'ei_is_valid', 'ei_algorithm', 'ei_uuid', 'ei_issue_date', 'ei_zip_key', 'ei_status_code',
+        'ei_status_description', 'ei_status_message', 'ei_xml_file_name', 'ei_xml_name', 'ei_zip_name',
+        'ei_url_acceptance', 'ei_url_rejection', 'ei_xml_bytes', 'ei_errors_messages', 'ei_qr_data',
+        'ei_application_response_base64_bytes', 'ei_attached_document_base64_bytes', 'ei_pdf_base64_bytes',
+        'ei_zip_base64_bytes', 'ei_dian_response_base64_bytes', 'ei_attached_zip_base64_bytes',
+        'ei_xml_base64_bytes', 'ei_signature', 'event', 'ei_attached_zip_checksum', 'ei_poll_count',
+        'ei_poll_next_date', 'ei_attached_cufe', 'ei_attached_issue_date', 'ei_attached_payable_amount',
+        'ei_attached_parent_document_id', 'ei_attached_response_code',
+    }
+
+    # Datos de un log valido de la API: (clave del log, campo)
+    _ei_log_fields = (
+        ('algorithm', 'ei_algorithm'),
+        # ('uuid', 'ei_uuid'),
+        ('issue_date', 'ei_issue_date'),
+        ('zip_key', 'ei_zip_key'),
+        # ('xml_file_name', 'ei_xml_file_name'),
+        ('xml_name', 'ei_xml_name'),
+        ('zip_name', 'ei_zip_name'),
+        ('xml_base64_bytes', 'ei_xml_base64_bytes'),
+        ('qr_data', 'ei_qr_data'),
+        ('application_response_base64_bytes', 'ei_application_response_base64_bytes'),
+        ('attached_document_base64_bytes', 'ei_attached_document_base64_bytes'),
+        ('pdf_base64_bytes', 'ei_pdf_base64_bytes'),
+        ('zip_base64_bytes', 'ei_zip_base64_bytes'),
+        ('signature', 'ei_signature'),
+    )
+
+    # Archivos de la DIAN, se guardan en el filestore por su checksum
+    _ei_binary_fields = (
+        'ei_pdf_base64_bytes', 'ei_zip_base64_bytes', 'ei_xml_base64_bytes', 'ei_attached_document_base64_bytes',
+        'ei_application_response_base64_bytes', 'ei_attached_zip_base64_bytes',
+    )
+
+    @api.model_cr_context
+    def _auto_init(self):
+        res = super(AccountInvoice, self)._auto_init()
+        # Busquedas por número de los eventos DIAN y de las referencias de las notas
+        tools.create_index(self._cr, 'account_invoice_company_number_formatted_index', self._table,
+                           ['company_id', 'number_formatted'])
+        tools.create_index(self._cr, 'account_invoice_company_number_index', self._table, ['company_id', 'number'])
+        return res
+
+    @api.multi
+    def write(self, vals):
+        if set(vals) - self._ei_response_fields:
+            self._invalidate_json_request()
+        vals = self._skip_unchanged_binaries(vals)
+        res = super(AccountInvoice, self).write(vals)
+        if 'ei_attached_document_base64_bytes' in vals:
+            self._extract_attached_document_metadata()
+        return res
+
+    @api.multi
+    def _skip_unchanged_binaries(self, vals):
+        """Remove from vals the DIAN files whose content is already stored on all the records.
+
+        The filestore keeps a single file per sha1 checksum, so writing the same content again only costs the
+        decoding, hashing and attachment update. Comparing the checksums avoids that on every status query.
+        """
+        binary_fields = [name for name in self._ei_binary_fields if name in vals]
+        if not binary_fields or not self.ids:
+            return vals
+
+        attachment_model = self.env['ir.attachment'].sudo()
+        checksums = {}
+        for attachment in attachment_model.search_read([
+            ('res_model', '=', self._name),
+            ('res_field', 'in', binary_fields),
+            ('res_id', 'in', self.ids),
+        ], ['res_field', 'res_id', 'checksum']):
+            checksums[(attachment['res_field'], attachment['res_id'])] = attachment['checksum']
+
+        vals = dict(vals)
+        for name in binary_fields:
+            value = vals[name]
+            checksum = attachment_model._compute_checksum(base64.b64decode(value)) if value else None
+            if all(checksums.get((name, rec_id)) == checksum for rec_id in self.ids):
+                del vals[name]
+        return vals
+
+    @api.depends('ei_qr_data')
+    def _compute_ei_qr_image(self):
+        # Cada QR distinto se genera una sola vez por recordset
+        images = {}
+        for rec in self:
+            if rec.ei_qr_data:
+                if rec.ei_qr_data not in images:
+                    images[rec.ei_qr_data] = self._make_qr_image(rec.ei_qr_data)
+                rec.ei_qr_image = images[rec.ei_qr_data]
+            else:
+                rec.ei_qr_image = False
+
+    @api.multi
+    def prerender_qr_images(self):
+        """Generate the QR images of the documents before rendering their reports.
+
+        The images are computed for the whole recordset and kept in the environment cache, the reports then
+        read them from there.
+        """
+        self.mapped('ei_qr_image')
+
+    @api.multi
+    def _prefetch_ei_report(self):
+        """Load everything the invoice report reads for the whole recordset and generate the QR images, so
+        rendering the documents one after the other doesn't query the database for each of them"""
+        self.mapped('partner_id').mapped('vat')
+        self.mapped('company_id.partner_id').mapped('vat')
+        self.mapped('journal_id.sequence_id.resolution_id').mapped('resolution_prefix')
+        self.mapped('debit_invoice_id').mapped('number')
+        self.mapped('tax_line_ids.tax_id').mapped('name')
+        self._prefetch_ei_lines()
+        self.prerender_qr_images()
+
+    @api.model
+    def _make_qr_image(self, qr_data):
+        """Return the base64 PNG image of the QR code"""
+        qr = qrcode.QRCode(
+            version=1,
+            error_correction=qrcode.constants.ERROR_CORRECT_M,
+            box_size=2,
+            border=2,
+        )
+        qr.add_data(qr_data)
+        qr.make(fit=True)
+        # Módulos de tamaño entero, con la imagen de al menos QR_IMAGE_SIZE pixeles
+        qr.box_size = max(int(math.ceil(QR_IMAGE_SIZE / float(qr.modules_count + 2 * qr.border))), 1)
+        img = qr.make_image()
+        temp = BytesIO()
+        img.save(temp, format="PNG")
+        return base64.b64encode(temp.getvalue())
+
     @api.multi
     def write_response(self, json_response):
+        # La respuesta ya es un dict, trae varios archivos en base64 y se escribe de una sola vez
         try:
-            json_request = json.loads(json.dumps(json_response))
-
-            for rec in self:
-                rec.ei_is_valid = json_request['is_valid']
-                rec.ei_algorithm = json_request['algorithm']
-                rec.ei_uuid = json_request['uuid']
-                rec.ei_issue_date = json_request['issue_date']
-                rec.ei_zip_key = json_request['zip_key']
-                rec.ei_status_code = json_request['status_code']
-                rec.ei_status_description = json_request['status_description']
-                rec.ei_status_message = json_request['status_message']
-                # rec.ei_xml_file_name = json_request['xml_file_name']
-                rec.ei_xml_name = json_request['xml_name']
-                rec.ei_zip_name = json_request['zip_name']
-                # rec.ei_url_acceptance = json_request['url_acceptance']
-                # rec.ei_url_rejection = json_request['url_rejection']
-                # rec.ei_xml_bytes = json_request['xml_bytes']
-                rec.ei_xml_base64_bytes = json_request['xml_base64_bytes']
-                if json_request['errors_messages']:
-                    rec.ei_errors_messages = str(json_request['errors_messages'])
-                rec.ei_qr_data = json_request['qr_data']
-                rec.ei_application_response_base64_bytes = json_request['application_response_base64_bytes']
-                rec.ei_attached_document_base64_bytes = json_request['attached_document_base64_bytes']
-                rec.ei_pdf_base64_bytes = json_request['pdf_base64_bytes']
-                rec.ei_zip_base64_bytes = json_request['zip_base64_bytes']
-                rec.ei_signature = json_request['signature']
-                # rec.ei_dian_response_base64_bytes = json_request['dian_response_base64_bytes']
-
-                # QR code
-                qr = qrcode.QRCode(
-                    version=1,
-                    error_correction=qrcode.constants.ERROR_CORRECT_M,
-                    box_size=2,
-                    border=2,
-                )
-                qr.add_data(rec.ei_qr_data)
-                qr.make(fit=True)
-                img = qr.make_image()
-                temp = BytesIO()
-                img.save(temp, format="PNG")
-                qr_image = base64.b64encode(temp.getvalue())
-                rec.ei_qr_image = qr_image
+            vals = {
+                'ei_is_valid': json_response['is_valid'],
+                'ei_algorithm': json_response['algorithm'],
+                'ei_uuid': json_response['uuid'],
+                'ei_issue_date': json_response['issue_date'],
+                'ei_zip_key': json_response['zip_key'],
+                'ei_status_code': json_response['status_code'],
+                'ei_status_description': json_response['status_description'],
+                'ei_status_message': json_response['status_message'],
+                # 'ei_xml_file_name': json_response['xml_file_name'],
+                'ei_xml_name': json_response['xml_name'],
+                'ei_zip_name': json_response['zip_name'],
+                # 'ei_url_acceptance': json_response['url_acceptance'],
+                # 'ei_url_rejection': json_response['url_rejection'],
+                # 'ei_xml_bytes': json_response['xml_bytes'],
+                'ei_xml_base64_bytes': json_response['xml_base64_bytes'],
+                'ei_qr_data': json_response['qr_data'],
+                'ei_application_response_base64_bytes': json_response['application_response_base64_bytes'],
+                'ei_attached_document_base64_bytes': json_response['attached_document_base64_bytes'],
+                'ei_pdf_base64_bytes': json_response['pdf_base64_bytes'],
+                'ei_zip_base64_bytes': json_response['zip_base64_bytes'],
+                'ei_signature': json_response['signature'],
+                # 'ei_dian_response_base64_bytes': json_response['dian_response_base64_bytes'],
+            }
+            if json_response['errors_messages']:
+                vals['ei_errors_messages'] = str(json_response['errors_messages'])
+
+            self.write(vals)
         except Exception as e:
             _logger.debug("Write response: %s", e)
             raise Warning("Write response: %s" % e)
@@ -308,126 +551,176 @@ class AccountInvoice(models.Model):
             "payable_amount": payable_amount
         }
 
+    @api.multi
+    def _prefetch_ei_lines(self):
+        """Load the lines of all the invoices with their products, units of measure and taxes.
+
+        Each relation is read for the whole recordset at once, so serializing the lines afterwards doesn't need
+        more queries no matter how many lines the invoices have.
+        """
+        invoice_lines = self.mapped('invoice_line_ids')
+        # Reading one stored field loads all the stored fields of the lines
+        invoice_lines.mapped('name')
+        products = invoice_lines.mapped('product_id')
+        products.mapped('code')
+        products.mapped('uom_id.edi_unit_measure_id')
+        products.mapped('edi_unit_measure_id')
+        taxes = invoice_lines.mapped('invoice_line_tax_ids')
+        taxes.mapped('name')
+        taxes.mapped('edi_tax_id.name')
+        return invoice_lines
+
+    @api.multi
+    def _resolve_origin_invoices(self):
+        """Return {note_id: invoice} with the invoices referenced by the origin of the notes.
+
+        The invoices are searched by company and number with a single query for the whole recordset, and
+        remembered until the end of the transaction.
+        """
+        cache = _ORIGIN_INVOICE_CACHE.setdefault(self.env.cr, {})
+        keys = {(rec.company_id.id, rec.origin) for rec in self if rec.origin}
+        missing = keys - set(cache)
+        if missing:
+            for key in missing:
+                cache[key] = False
+            invoices = self.search([
+                ('company_id', 'in', list({company_id for company_id, origin in missing})),
+                ('number', 'in', list({origin for company_id, origin in missing})),
+            ], order='id')
+            for invoice in invoices:
+                key = (invoice.company_id.id, invoice.number)
+                if key in missing and not cache[key]:
+                    cache[key] = invoice.id
+        return {
+            rec.id: self.browse(cache[(rec.company_id.id, rec.origin)])
+            for rec in self if rec.origin and cache[(rec.company_id.id, rec.origin)]
+        }
+
     @api.multi
     def get_ei_lines(self):
+        self._prefetch_ei_lines()
         lines = []
         for rec in self:
             for invoice_line_id in rec.invoice_line_ids:
                 if invoice_line_id.account_id:
-                    price_unit = invoice_line_id.price_unit
-                    # el diccionario temporal de elementos que pertenecen a la linea especifica
-                    invoice_temps = {}
-                    products = {}
-                    allowance_charges = {}
-                    tax_totals = {'tax_totals': []}
-                    products.update({'price_amount': price_unit})
-                    products.update({'base_quantity': 1.000000})
-
-                    if invoice_line_id.product_id.code:
-                        products.update({'code': invoice_line_id.product_id.code})
-                    else:
-                        raise Warning("Todos los productos deben tener asignada una 'Referencia interna'.\n"
-                                      "Revise, por favor.")
-
-                    products.update({'description': invoice_line_id.name})
+                    lines.append(self._get_ei_line(invoice_line_id))
 
-                    if invoice_line_id.product_id.uom_id.edi_unit_measure_id.id:
-                        products.update({'unit_measure_id': invoice_line_id.product_id.uom_id.edi_unit_measure_id.id})
-                    elif invoice_line_id.product_id.edi_unit_measure_id.id:
-                        # Si se usa la configuracion en la unidad de medida de Odoo, entonces este campo no es necesario
-                        # Sin embargo se deja por compatibilidad con campos ya existentes
-                        products.update({'unit_measure_id': invoice_line_id.product_id.edi_unit_measure_id.id})
-                    else:
-                        raise Warning("Todos los productos deben tener asignada una 'Unidad de medida (DIAN)'.\n"
-                                      "Revise, por favor.")
-
-                    products.update({'invoiced_quantity': invoice_line_id.quantity})
-                    products.update({'line_extension_amount': invoice_line_id.price_subtotal})
-                    # [4]: Estándar de adopción del contribuyente ('999')
-                    products.update({'type_item_identification_id': 4})
-                    # ALLOWANCE_CHARGES_CONFIGURATION
-                    discount = False
-                    # descargos
-                    if invoice_line_id.discount:
-                        discount = True
-                        # products.update({'free_of_charge_indicator': False})
-                        # products.update({'reference_price_id': 3})  # Otro valor ('03')
-                        allowance_charges.update({'charge_indicator': False})
-                        amount = (invoice_line_id.discount / 100.0) * (
-                                invoice_line_id.quantity * invoice_line_id.price_unit)
-                        base_amount = invoice_line_id.discount
-                        allowance_charge_reason = "Discount"
-                    else:
-                        discount = False
-                        # products.update({'free_of_charge_indicator': False})
-                        # products.update({'reference_price_id': 1})  # Valor comercial ('01')
-                        allowance_charges.update({'charge_indicator': False})
-                        amount = 0
-                        base_amount = 0
-                        allowance_charge_reason = ""
-
-                    products.update({'reference_price_id': 1})  # Valor comercial ('01')
-
-                    taxable_amount = invoice_line_id.price_subtotal
-                    free_of_charge_indicator = not bool(taxable_amount)
-                    products.update({'free_of_charge_indicator': free_of_charge_indicator})
-
-                    allowance_charges.update({'base_amount': base_amount})
-                    allowance_charges.update({'amount': amount})
-                    allowance_charges.update({'allowance_charge_reason': allowance_charge_reason})
-
-                    # taxable_amount = invoice_line_id.price_subtotal
-                    # total_line_price = price_unit * invoice_line_id.quantity
-
-                    # Calculate tax totals for invoice line
-                    for invoice_line_tax_id in invoice_line_id.invoice_line_tax_ids:  # itercion_para_obtener_los_impuestos
-                        tax_total = {}
-
-                        if invoice_line_tax_id.edi_tax_id.id:
-                            edi_tax_name = invoice_line_tax_id.edi_tax_id.name
-                            tax_name = invoice_line_tax_id.name
-                            # La informacion enviada a la DIAN no debe incluir las retefuentes
-                            if edi_tax_name[:4] != 'Rete' and tax_name != 'IVA Excluido':
-                                if invoice_line_tax_id.amount_type == 'percent':
-                                    tax_total.update({'tax_id': invoice_line_tax_id.edi_tax_id.id})
-                                    tax_total.update(
-                                        {'tax_amount': (taxable_amount * invoice_line_tax_id.amount) / 100.0})
-                                    tax_total.update({'taxable_amount': taxable_amount})
-                                    tax_total.update({'percent': invoice_line_tax_id.amount})
-                                    tax_totals['tax_totals'].append(tax_total)
-                                elif invoice_line_tax_id.amount_type == 'fixed':
-                                    tax_total.update({'tax_id': invoice_line_tax_id.edi_tax_id.id})
-                                    tax_total.update(
-                                        {'tax_amount': invoice_line_id.quantity * invoice_line_tax_id.amount})
-                                    tax_total.update({'taxable_amount': 0})
-                                    # "886","número de unidades internacionales","NIU"
-                                    tax_total.update({'unit_measure_id': 886})
-                                    tax_total.update({'per_unit_amount': invoice_line_tax_id.amount})
-                                    tax_total.update({'base_unit_measure': "1.000000"})
-                                    tax_totals['tax_totals'].append(tax_total)
-                                else:
-                                    raise Warning(
-                                        "La facturación electrónica aún no es compatible con este tipo de impuesto.")
-                        else:
-                            raise Warning("Todos los impuestos deben tener asignado un 'Tipo de impuesto (DIAN)'.\n"
-                                          "Revise por favor e intente nuevamente")
+        return lines
 
-                    # ACTUALIZA TODOS LOS ELEMENTOS DEL PRODUCTO
-                    invoice_temps.update(products)
+    @api.model
+    def _get_ei_line(self, invoice_line_id):
+        price_unit = invoice_line_id.price_unit
+        # el diccionario temporal de elementos que pertenecen a la linea especifica
+        invoice_temps = {}
+        products = {}
+        allowance_charges = {}
+        tax_totals = {'tax_totals': []}
+        products.update({'price_amount': price_unit})
+        products.update({'base_quantity': 1.000000})
+
+        if invoice_line_id.product_id.code:
+            products.update({'code': invoice_line_id.product_id.code})
+        else:
+            raise Warning("Todos los productos deben tener asignada una 'Referencia interna'.\n"
+                          "Revise, por favor.")
 
-                    # ACTUALIZA TODOS LOS DESCUENTOS DEL PRODUCTO (*SE SUPONE UNO SOLO*)
-                    if discount:
-                        invoice_temps.update({'allowance_charges': [allowance_charges]})
+        products.update({'description': invoice_line_id.name})
 
-                    # los impuestos se adjuntan dentro de este json
-                    if tax_totals['tax_totals']:
-                        invoice_temps.update({'tax_totals': tax_totals['tax_totals']})
+        if invoice_line_id.product_id.uom_id.edi_unit_measure_id.id:
+            products.update({'unit_measure_id': invoice_line_id.product_id.uom_id.edi_unit_measure_id.id})
+        elif invoice_line_id.product_id.edi_unit_measure_id.id:
+            # Si se usa la configuracion en la unidad de medida de Odoo, entonces este campo no es necesario
+            # Sin embargo se deja por compatibilidad con campos ya existentes
+            products.update({'unit_measure_id': invoice_line_id.product_id.edi_unit_measure_id.id})
+        else:
+            raise Warning("Todos los productos deben tener asignada una 'Unidad de medida (DIAN)'.\n"
+                          "Revise, por favor.")
+
+        products.update({'invoiced_quantity': invoice_line_id.quantity})
+        products.update({'line_extension_amount': invoice_line_id.price_subtotal})
+        # [4]: Estándar de adopción del contribuyente ('999')
+        products.update({'type_item_identification_id': 4})
+        # ALLOWANCE_CHARGES_CONFIGURATION
+        discount = False
+        # descargos
+        if invoice_line_id.discount:
+            discount = True
+            # products.update({'free_of_charge_indicator': False})
+            # products.update({'reference_price_id': 3})  # Otro valor ('03')
+            allowance_charges.update({'charge_indicator': False})
+            amount = (invoice_line_id.discount / 100.0) * (
+                    invoice_line_id.quantity * invoice_line_id.price_unit)
+            base_amount = invoice_line_id.discount
+            allowance_charge_reason = "Discount"
+        else:
+            discount = False
+            # products.update({'free_of_charge_indicator': False})
+            # products.update({'reference_price_id': 1})  # Valor comercial ('01')
+            allowance_charges.update({'charge_indicator': False})
+            amount = 0
+            base_amount = 0
+            allowance_charge_reason = ""
+
+        products.update({'reference_price_id': 1})  # Valor comercial ('01')
+
+        taxable_amount = invoice_line_id.price_subtotal
+        free_of_charge_indicator = not bool(taxable_amount)
+        products.update({'free_of_charge_indicator': free_of_charge_indicator})
+
+        allowance_charges.update({'base_amount': base_amount})
+        allowance_charges.update({'amount': amount})
+        allowance_charges.update({'allowance_charge_reason': allowance_charge_reason})
+
+        # taxable_amount = invoice_line_id.price_subtotal
+        # total_line_price = price_unit * invoice_line_id.quantity
+
+        # Calculate tax totals for invoice line
+        for invoice_line_tax_id in invoice_line_id.invoice_line_tax_ids:  # itercion_para_obtener_los_impuestos
+            tax_total = {}
+
+            if invoice_line_tax_id.edi_tax_id.id:
+                edi_tax_name = invoice_line_tax_id.edi_tax_id.name
+                tax_name = invoice_line_tax_id.name
+                # La informacion enviada a la DIAN no debe incluir las retefuentes
+                if edi_tax_name[:4] != 'Rete' and tax_name != 'IVA Excluido':
+                    if invoice_line_tax_id.amount_type == 'percent':
+                        tax_total.update({'tax_id': invoice_line_tax_id.edi_tax_id.id})
+                        tax_total.update(
+                            {'tax_amount': (taxable_amount * invoice_line_tax_id.amount) / 100.0})
+                        tax_total.update({'taxable_amount': taxable_amount})
+                        tax_total.update({'percent': invoice_line_tax_id.amount})
+                        tax_totals['tax_totals'].append(tax_total)
+                    elif invoice_line_tax_id.amount_type == 'fixed':
+                        tax_total.update({'tax_id': invoice_line_tax_id.edi_tax_id.id})
+                        tax_total.update(
+                            {'tax_amount': invoice_line_id.quantity * invoice_line_tax_id.amount})
+                        tax_total.update({'taxable_amount': 0})
+                        # "886","número de unidades internacionales","NIU"
+                        tax_total.update({'unit_measure_id': 886})
+                        tax_total.update({'per_unit_amount': invoice_line_tax_id.amount})
+                        tax_total.update({'base_unit_measure': "1.000000"})
+                        tax_totals['tax_totals'].append(tax_total)
                     else:
-                        invoice_temps.pop("reference_price_id")
+                        raise Warning(
+                            "La facturación electrónica aún no es compatible con este tipo de impuesto.")
+            else:
+                raise Warning("Todos los impuestos deben tener asignado un 'Tipo de impuesto (DIAN)'.\n"
+                              "Revise por favor e intente nuevamente")
 
-                    lines.append(invoice_temps)
+        # ACTUALIZA TODOS LOS ELEMENTOS DEL PRODUCTO
+        invoice_temps.update(products)
 
-        return lines
+        # ACTUALIZA TODOS LOS DESCUENTOS DEL PRODUCTO (*SE SUPONE UNO SOLO*)
+        if discount:
+            invoice_temps.update({'allowance_charges': [allowance_charges]})
+
+        # los impuestos se adjuntan dentro de este json
+        if tax_totals['tax_totals']:
+            invoice_temps.update({'tax_totals': tax_totals['tax_totals']})
+        else:
+            invoice_temps.pop("reference_price_id")
+
+        return invoice_temps
 
     # Calculo de las retenciones, excluidos, etc
     @api.one
@@ -483,22 +776,20 @@ class AccountInvoice(models.Model):
             if rec.date_invoice and rec.date_due:
                 if rec.date_invoice >= rec.date_due:
                     # Contado
-                    payment_forms_rec = payment_forms_env.search([('code', '=', '1')])
+                    payment_form_id = payment_forms_env.get_id_by_code('1')
                     duration_measure = 0
                 else:
                     # Credito
-                    payment_forms_rec = payment_forms_env.search([('code', '=', '2')])
+                    payment_form_id = payment_forms_env.get_id_by_code('2')
                     duration_measure = (rec.date_due - rec.date_invoice).days
                 payment_due_date = fields.Date.to_string(rec.date_due)
             else:
                 _logger.debug("La fecha de factura o de pago no son validas")
                 # Contado
-                payment_forms_rec = payment_forms_env.search([('code', '=', '1')])
+                payment_form_id = payment_forms_env.get_id_by_code('1')
                 duration_measure = 0
                 payment_due_date = fields.Date.to_string(rec.date_invoice)
 
-            payment_form_id = payment_forms_rec.id
-
             # Por ahora siempre pones metodo de pago como 'instrumento no definido' [1]
             return {
                 'payment_form_id': payment_form_id,
@@ -519,19 +810,19 @@ class AccountInvoice(models.Model):
         if type_edi_document != 'none':
             if type_edi_document == 'invoice':
                 # Factura de venta
-                type_documents_rec = type_documents_env.search([('code', '=', '01')])
+                type_document_id = type_documents_env.get_id_by_code('01')
             elif type_edi_document == 'credit-note':
                 # Nota credito
-                type_documents_rec = type_documents_env.search([('code', '=', '91')])
+                type_document_id = type_documents_env.get_id_by_code('91')
             elif type_edi_document == 'debit-note':
                 # Nota debito
-                type_documents_rec = type_documents_env.search([('code', '=', '92')])
+                type_document_id = type_documents_env.get_id_by_code('92')
             else:
                 raise Warning("Este tipo de documento no necesita ser enviado a la DIAN")
         else:
             raise Warning("Este tipo de documento no necesita ser enviado a la DIAN")
 
-        self.ei_type_document_id = type_documents_rec.id
+        self.ei_type_document_id = type_document_id
 
         return self.ei_type_document_id.id
 
@@ -592,6 +883,41 @@ class AccountInvoice(models.Model):
 
     @api.multi
     def get_json_request(self):
+        """Return the json request of the document.
+
+        The request is built once per transaction and reused, for the same user and context, until the invoice is
+        written again or its write_date changes. Writes of the API response fields don't invalidate it, they don't
+        change the request. Changes of the lines drop the request of their invoice, and changes of partners,
+        products, product templates, units of measure or taxes drop all of them. Each call returns its own copy.
+        """
+        for rec in self:
+            if not isinstance(rec.id, int):
+                return rec._build_json_request()
+
+            cache = _JSON_REQUEST_CACHE.setdefault(self.env.cr, {})
+            key = (rec.write_date, self.env.uid, dict(self.env.context))
+            cached = cache.get(rec.id)
+            if cached and cached[0] == key:
+                return copy.deepcopy(cached[1])
+
+            json_request = rec._build_json_request()
+            cache[rec.id] = (key, json_request)
+            return copy.deepcopy(json_request)
+
+    @api.multi
+    def _invalidate_json_request(self):
+        cache = _JSON_REQUEST_CACHE.get(self.env.cr)
+        if cache:
+            for rec_id in self.ids:
+                cache.pop(rec_id, None)
+
+    @api.model
+    def _clear_json_request_cache(self):
+        """Drop all the json requests built in the transaction"""
+        _JSON_REQUEST_CACHE.pop(self.env.cr, None)
+
+    @api.multi
+    def _build_json_request(self):
         for rec in self:
             # Si es factura de venta o Nota credito o Nota debito.
             if rec.type == 'out_invoice' or rec.type == 'out_refund':
@@ -613,12 +939,12 @@ class AccountInvoice(models.Model):
                     invoice_currency_code = rec.currency_id.name
 
                     type_currencies_env = self.env['l10n_co_edi_jorels.type_currencies']
-                    company_currency_search = type_currencies_env.search([('code', '=', company_currency_code)])
-                    invoice_currency_search = type_currencies_env.search([('code', '=', invoice_currency_code)])
+                    company_currency_id = type_currencies_env.get_id_by_code(company_currency_code)
+                    invoice_currency_id = type_currencies_env.get_id_by_code(invoice_currency_code)
 
                     # El if es para asegurarse que el name en currency_id,
                     # tenga una correspondencia en el code en type_currencies de la DIAN
-                    if company_currency_search and invoice_currency_search:
+                    if company_currency_id and invoice_currency_id:
 
                         # El inverso de Odoo,
                         # pues por ejemplo para company=COP y invoice=USD,
@@ -639,9 +965,9 @@ class AccountInvoice(models.Model):
 
                         rate_date = self._get_currency_rate_date() or fields.Date.context_today(self)
 
-                        json_request['type_currency_id'] = invoice_currency_search.id
+                        json_request['type_currency_id'] = invoice_currency_id
                         json_request['payment_exchange_rate'] = {
-                            'type_currency_id': company_currency_search.id,
+                            'type_currency_id': company_currency_id,
                             'calculation_rate': calculation_rate,
                             'date': str(rate_date)
                         }
@@ -674,8 +1000,7 @@ class AccountInvoice(models.Model):
 
                 # Billing reference
                 if billing_reference:
-                    invoice_env = self.env['account.invoice']
-                    invoice_rec = invoice_env.search([('number', '=', rec.origin)])
+                    invoice_rec = rec._resolve_origin_invoices().get(rec.id, self.browse())
                     if invoice_rec.ei_uuid:
                         invoice_prefix = invoice_rec.number.split(invoice_rec.ei_number)[0]
                         invoice_number = str(int(invoice_rec.ei_number))
@@ -733,83 +1058,176 @@ class AccountInvoice(models.Model):
         return type_edi_document
 
     @api.multi
-    def validate_dian_generic(self, is_test):
-        # raise Warning(json.dumps(self.get_json_request(), indent=2, sort_keys=False))
-        _logger.debug("Request Validación DIAN: %s", json.dumps(self.get_json_request(), indent=2, sort_keys=False))
+    def get_ei_api_request(self, is_test):
+        """Return the API client, endpoint path, token and json data needed to send the document"""
+        self.ensure_one()
+        type_edi_document = self.get_type_edi_document()
+        if type_edi_document == 'none':
+            raise Warning("Este tipo de documento no necesita ser enviado  la DIAN")
 
-        for rec in self:
-            try:
-                type_edi_document = self.get_type_edi_document()
-                if type_edi_document != 'none':
-                    requests_data = self.get_json_request()
+        requests_data = self.get_json_request()
 
-                    if self.env.user.company_id.api_key:
-                        token = self.env.user.company_id.api_key
-                    else:
-                        raise Warning("Debe configurar un token para poder facturar electrónicamente")
+        if self.env.user.company_id.api_key:
+            token = self.env.user.company_id.api_key
+        else:
+            raise Warning("Debe configurar un token para poder facturar electrónicamente")
 
-                    if self.env.user.company_id.api_url:
-                        api_url = self.env.user.company_id.api_url
-                    else:
-                        raise Warning("No ha configurado una URL API para la facturación electrónica")
+        if self.env.user.company_id.api_url:
+            api_url = self.env.user.company_id.api_url
+        else:
+            raise Warning("No ha configurado una URL API para la facturación electrónica")
 
-                    header = {"accept": "application/json", "Content-Type": "application/json"}
+        path = "/api/ubl2.1/" + type_edi_document
 
-                    api_url = api_url + "/api/ubl2.1/" + type_edi_document
+        if is_test or not self.ei_is_not_test:
+            if self.env.user.company_id.test_set_id:
+                test_set_id = self.env.user.company_id.test_set_id
+                path = path + '/' + test_set_id
+            else:
+                raise Warning("No ha configurado un 'TestSetId'. "
+                              "Sin este no puede hacer pruebas para habilitación.")
 
-                    if is_test or not rec.ei_is_not_test:
-                        if self.env.user.company_id.test_set_id:
-                            test_set_id = self.env.user.company_id.test_set_id
-                            api_url = api_url + '/' + test_set_id
-                        else:
-                            raise Warning("No ha configurado un 'TestSetId'. "
-                                          "Sin este no puede hacer pruebas para habilitación.")
+        _logger.debug('API URL: %s', api_url + path)
 
-                    _logger.debug('API URL: %s', api_url)
+        return jorels_api.get_client(api_url), path, token, requests_data
 
-                    header.update({'Authorization': 'Bearer ' + token})
-                    response = requests.post(api_url, json.dumps(requests_data), headers=header).json()
-                    _logger.debug('API Response: %s', response)
+    @api.multi
+    def process_ei_response(self, response):
+        """Write the API response on the document.
 
-                    if 'message' in response:
-                        if response['message'] == 'Unauthenticated.' or response['message'] == '':
-                            raise Warning("Error de autenticación con la API de facturación electrónica. "
-                                          "Verifique que sus credenciales sean validas")
-                        else:
-                            if 'errors' in response:
-                                raise Warning(response['message'] + '/ errors: ' + str(response['errors']))
-                            else:
-                                raise Warning(response['message'])
-                    elif 'is_valid' in response:
-                        self.write_response(response)
-                        if response['is_valid']:
-                            self.env.user.notify_success(message="La validación ante la DIAN ha sido exitosa.")
-                        elif 'uuid' in response:
-                            if response['uuid'] != "":
-                                if not rec.ei_is_not_test:
-                                    self.env.user.notify_success(message="Documento enviado a la DIAN en habilitación.")
-                                else:
-                                    temp_message = {self.ei_status_message, self.ei_errors_messages,
-                                                    self.ei_status_description, self.ei_status_code}
-                                    raise Warning(str(temp_message))
-                            else:
-                                raise Warning('No se ha obtenido un UUID valido. Intente nuevamente.')
-                        else:
-                            raise Warning('No se ha podido validar el documento ante la DIAN.')
+        Return the success message or raise a Warning if the document was not accepted.
+        """
+        self.ensure_one()
+        if 'message' in response:
+            if response['message'] == 'Unauthenticated.' or response['message'] == '':
+                raise Warning("Error de autenticación con la API de facturación electrónica. "
+                              "Verifique que sus credenciales sean validas")
+            else:
+                if 'errors' in response:
+                    raise Warning(response['message'] + '/ errors: ' + str(response['errors']))
+                else:
+                    raise Warning(response['message'])
+        elif 'is_valid' in response:
+            self.write_response(response)
+            if response['is_valid']:
+                return "La validación ante la DIAN ha sido exitosa."
+            elif 'uuid' in response:
+                if response['uuid'] != "":
+                    if not self.ei_is_not_test:
+                        return "Documento enviado a la DIAN en habilitación."
                     else:
-                        raise Warning("No se ha obtenido una respuesta logica por parte de la API")
+                        temp_message = {self.ei_status_message, self.ei_errors_messages,
+                                        self.ei_status_description, self.ei_status_code}
+                        raise Warning(str(temp_message))
                 else:
-                    raise Warning("Este tipo de documento no necesita ser enviado  la DIAN")
+                    raise Warning('No se ha obtenido un UUID valido. Intente nuevamente.')
+            else:
+                raise Warning('No se ha podido validar el documento ante la DIAN.')
+        else:
+            raise Warning("No se ha obtenido una respuesta logica por parte de la API")
+
+    @api.multi
+    def status_document_follow_up(self, is_test):
+        """Schedule the status poller when the API did not return the attached document.
+
+        The emails of the mass send wait in their queue until the poller gets it.
+        """
+        if is_test:
+            return
+        attachments = self._get_ei_attachments('ei_attached_document_base64_bytes')
+        self.filtered(lambda inv: inv.id not in attachments).write({
+            'ei_poll_count': 0,
+            'ei_poll_next_date': fields.Datetime.now(),
+        })
+
+    @api.multi
+    def validate_dian_generic(self, is_test):
+        for rec in self:
+            try:
+                client, path, token, requests_data = rec.get_ei_api_request(is_test)
+                if _logger.isEnabledFor(logging.DEBUG):
+                    _logger.debug("Request Validación DIAN: %s",
+                                  json.dumps(requests_data, indent=2, sort_keys=False))
+
+                response = client.post(path, token, requests_data)
+                _logger.debug('API Response: %s', response)
+
+                self.env.user.notify_success(message=rec.process_ei_response(response))
             except Exception as e:
                 _logger.debug("Error al procesar la solicitud: %s", e)
                 raise Warning("Error al procesar la solicitud: %s" % e)
 
-            if not is_test and not rec.ei_attached_document_base64_bytes:
-                rec.status_document_log()
-                if not rec.ei_attached_document_base64_bytes:
-                    rec.status_document()
-                    if not rec.ei_attached_document_base64_bytes:
-                        _logger.error('No se ha logrado obtener un documento adjunto (attached document)')
+            rec.status_document_follow_up(is_test)
+
+    @api.multi
+    def validate_dian_batch(self, is_test):
+        """Send the documents to the API concurrently.
+
+        The requests are built and the responses are written in the current thread, only the HTTP calls of the
+        shared API client run in the thread pool. A failed document doesn't stop the others, its changes are
+        rolled back.
+
+        :return: dict {invoice_id: {'success': bool, 'message': str}}, failures where the request surely didn't
+            reach the API are flagged with 'unavailable': True. The ones that may have reached it are left for a
+            manual check, sending them again could duplicate the document in the DIAN
+        """
+        summary = {}
+        pending = {}
+        self._prefetch_ei_lines()
+        self._resolve_origin_invoices()
+        for rec in self:
+            try:
+                with self.env.cr.savepoint():
+                    pending[rec.id] = rec.get_ei_api_request(is_test)
+            except Exception as e:
+                _logger.debug("Error al procesar la solicitud: %s", e)
+                summary[rec.id] = {'success': False, 'message': str(e)}
+
+        calls = {
+            invoice_id: (client.post, (path, token, requests_data))
+            for invoice_id, (client, path, token, requests_data) in pending.items()
+        }
+        for invoice_id, response, error in _run_concurrently(calls, self.env.user.company_id.ei_max_workers):
+            rec = self.browse(invoice_id)
+            try:
+                if error:
+                    raise error
+                with self.env.cr.savepoint():
+                    _logger.debug('API Response: %s', response)
+                    message = rec.process_ei_response(response)
+                summary[rec.id] = {'success': True, 'message': message}
+            except Exception as e:
+                _logger.debug("Error al procesar la solicitud: %s", e)
+                message = str(e)
+                if jorels_api.is_ambiguous_error(e):
+                    message = "No se recibió respuesta de la API y el documento pudo llegar a la DIAN. " \
+                              "Consulte su estado antes de reintentar el envío: %s" % e
+                summary[rec.id] = {'success': False, 'message': message,
+                                   'unavailable': jorels_api.is_unavailable_error(e)}
+
+        self.filtered(lambda inv: summary[inv.id]['success']).status_document_follow_up(is_test)
+        return summary
+
+    @api.multi
+    def action_validate_dian_batch(self):
+        """Validate the documents waiting for DIAN validation and notify a summary"""
+        to_validate = self.filtered(lambda inv: inv.state == 'validate' and inv.type in ('out_invoice', 'out_refund'))
+
+        summary = to_validate.filtered(lambda inv: inv.ei_is_not_test).validate_dian_batch(False)
+        summary.update(to_validate.filtered(lambda inv: not inv.ei_is_not_test).validate_dian_batch(True))
+
+        validated = to_validate.filtered(lambda inv: summary[inv.id]['success'])
+        validated.write({'state': 'open'})
+
+        failed = to_validate - validated
+        if validated:
+            self.env.user.notify_success(message="Documentos validados: %s" % len(validated))
+        if failed:
+            self.env.user.notify_warning(
+                message="Documentos con errores: %s\n%s" % (len(failed), '\n'.join(
+                    [(inv.number or str(inv.id)) + ': ' + summary[inv.id]['message'] for inv in failed])),
+                sticky=True)
+        return summary
 
     @api.multi
     def validate_dian(self):
@@ -868,10 +1286,26 @@ class AccountInvoice(models.Model):
                 if to_open_invoices.filtered(lambda inv: inv.env.user.company_id.enable_validate_state):
                     return to_open_invoices.filtered(lambda inv: inv.write({'state': 'validate'}))
 
+                # Validación asíncrona, la cola de envíos valida y abre las facturas
+                if self.env.user.company_id.ei_async_validation:
+                    to_open_invoices.write({'state': 'validate'})
+                    self.env['l10n_co_edi_jorels.submission'].enqueue(to_open_invoices)
+                    return res
+
+                # Si la API está caída, las facturas quedan en cola para reintentarlas cuando se recupere
+                if not jorels_api.is_available(self.env.user.company_id.api_url):
+                    to_open_invoices.write({'state': 'validate'})
+                    self.env['l10n_co_edi_jorels.submission'].enqueue(to_open_invoices)
+                    self.env.user.notify_warning(message="La API de facturación electrónica no está disponible. "
+                                                         "Los documentos se enviarán a la DIAN automáticamente.")
+                    return res
+
                 if to_open_invoices.filtered(lambda inv: inv.ei_is_not_test):
                     to_open_invoices.validate_dian_generic(False)
-                    if to_open_invoices.filtered(lambda inv: inv.env.user.company_id.enable_mass_send_print):
-                        to_open_invoices.mass_send_print()
+                    # Los correos se envían en segundo plano
+                    if self.env.user.company_id.enable_mass_send_print:
+                        self.env['l10n_co_edi_jorels.mail_submission'].enqueue(
+                            to_open_invoices.filtered(lambda inv: inv.ei_is_not_test))
                 if to_open_invoices.filtered(lambda inv: not inv.ei_is_not_test):
                     to_open_invoices.validate_dian_generic(True)
 
@@ -908,44 +1342,14 @@ class AccountInvoice(models.Model):
                     else:
                         raise Warning("No ha configurado una URL API para la facturación electrónica")
 
-                    header = {"accept": "application/json", "Content-Type": "application/json"}
-
-                    api_url = api_url + "/api/ubl2.1/status/document/" + self.ei_uuid
+                    path = "/api/ubl2.1/status/document/" + self.ei_uuid
 
-                    _logger.debug('API URL: %s', api_url)
+                    _logger.debug('API URL: %s', api_url + path)
 
-                    header.update({'Authorization': 'Bearer ' + token})
-                    response = requests.post(api_url, json.dumps(requests_data), headers=header).json()
+                    response = jorels_api.get_client(api_url).post(path, token, requests_data)
                     _logger.debug('API Response: %s', response)
 
-                    if 'message' in response:
-                        if response['message'] == 'Unauthenticated.' or response['message'] == '':
-                            raise Warning("Error de autenticación con la API de facturación electrónica. "
-                                          "Verifique que sus credenciales sean validas")
-                        else:
-                            if 'errors' in response:
-                                raise Warning(response['message'] + '/ errors: ' + str(response['errors']))
-                            else:
-                                raise Warning(response['message'])
-                    elif 'is_valid' in response:
-                        self.write_response(response)
-                        if response['is_valid']:
-                            self.env.user.notify_info(message="La validación ante la DIAN ha sido exitosa.")
-                        elif 'uuid' in response:
-                            if response['uuid'] != "":
-                                if not self.ei_is_not_test:
-                                    self.env.user.notify_info(
-                                        message="Documento enviado a la DIAN en habilitación.")
-                                else:
-                                    temp_message = {self.ei_status_message, self.ei_errors_messages,
-                                                    self.ei_status_description, self.ei_status_code}
-                                    raise Warning(str(temp_message))
-                            else:
-                                raise Warning('No se ha obtenido un UUID valido. Intente nuevamente.')
-                        else:
-                            raise Warning('No se ha podido validar el documento ante la DIAN.')
-                    else:
-                        raise Warning("No se ha obtenido una respuesta logica por parte de la API")
+                    self.env.user.notify_info(message=self.process_ei_response(response))
                 else:
                     raise Warning("Se necesita un UUID para verificar el estado del documento.")
             else:
@@ -954,6 +1358,22 @@ class AccountInvoice(models.Model):
             _logger.debug("Error al procesar la solicitud: %s", e)
             raise Warning("Error al procesar la solicitud: %s" % e)
 
+    @api.multi
+    def write_log_response(self, logs):
+        """Write the first valid log of the API on the document, return False if there is none"""
+        self.ensure_one()
+        for log in logs:
+            if log['is_valid']:
+                vals = {'ei_is_valid': log['is_valid']}
+                # Solo se escriben los datos que trae el log
+                for key, field_name in self._ei_log_fields:
+                    if log[key]:
+                        vals[field_name] = log[key]
+
+                self.write(vals)
+                return True
+        return False
+
     @api.multi
     def status_document_log(self):
         for rec in self:
@@ -979,14 +1399,11 @@ class AccountInvoice(models.Model):
                         else:
                             raise Warning("No ha configurado una URL API para la facturación electrónica")
 
-                        header = {"accept": "application/json", "Content-Type": "application/json"}
+                        path = "/api/ubl2.1/logs/" + rec.ei_uuid
 
-                        api_url = api_url + "/api/ubl2.1/logs/" + rec.ei_uuid
+                        _logger.debug('API URL: %s', api_url + path)
 
-                        _logger.debug('API URL: %s', api_url)
-
-                        header.update({'Authorization': 'Bearer ' + token})
-                        response = requests.post(api_url, json.dumps(requests_data), headers=header).json()
+                        response = jorels_api.get_client(api_url).post(path, token, requests_data)
                         _logger.debug('API Response: %s', response)
 
                         if 'message' in response:
@@ -1005,59 +1422,7 @@ class AccountInvoice(models.Model):
                                     self.env.user.notify_warning(message=response['message'])
                                     _logger.debug(response['message'])
                         elif response and ('id' in response[0]):
-                            success = False
-                            for log in response:
-                                if log['is_valid']:
-                                    json_request = json.loads(json.dumps(log))
-                                    rec.ei_is_valid = json_request['is_valid']
-                                    if json_request['algorithm']:
-                                        rec.ei_algorithm = json_request['algorithm']
-                                    # if json_request['uuid']:
-                                    #     rec.ei_uuid = json_request['uuid']
-                                    if json_request['issue_date']:
-                                        rec.ei_issue_date = json_request['issue_date']
-                                    if json_request['zip_key']:
-                                        rec.ei_zip_key = json_request['zip_key']
-                                    # if json_request['xml_file_name']:
-                                    #     rec.ei_xml_file_name = json_request['xml_file_name']
-                                    if json_request['xml_name']:
-                                        rec.ei_xml_name = json_request['xml_name']
-                                    if json_request['zip_name']:
-                                        rec.ei_zip_name = json_request['zip_name']
-                                    if json_request['xml_base64_bytes']:
-                                        rec.ei_xml_base64_bytes = json_request['xml_base64_bytes']
-                                    if json_request['qr_data']:
-                                        rec.ei_qr_data = json_request['qr_data']
-                                    if json_request['application_response_base64_bytes']:
-                                        rec.ei_application_response_base64_bytes = json_request[
-                                            'application_response_base64_bytes']
-                                    if json_request['attached_document_base64_bytes']:
-                                        rec.ei_attached_document_base64_bytes = json_request[
-                                            'attached_document_base64_bytes']
-                                    if json_request['pdf_base64_bytes']:
-                                        rec.ei_pdf_base64_bytes = json_request['pdf_base64_bytes']
-                                    if json_request['zip_base64_bytes']:
-                                        rec.ei_zip_base64_bytes = json_request['zip_base64_bytes']
-                                    if json_request['signature']:
-                                        rec.ei_signature = json_request['signature']
-
-                                        # QR code
-                                        qr = qrcode.QRCode(
-                                            version=1,
-                                            error_correction=qrcode.constants.ERROR_CORRECT_M,
-                                            box_size=2,
-                                            border=2,
-                                        )
-                                        qr.add_data(rec.ei_qr_data)
-                                        qr.make(fit=True)
-                                        img = qr.make_image()
-                                        temp = BytesIO()
-                                        img.save(temp, format="PNG")
-                                        qr_image = base64.b64encode(temp.getvalue())
-                                        rec.ei_qr_image = qr_image
-
-                                    success = True
-                                    break
+                            success = rec.write_log_response(response)
                             if success:
                                 self.env.user.notify_info(message="La validación ante la DIAN ha sido exitosa.")
                                 _logger.debug("La validación ante la DIAN ha sido exitosa.")
@@ -1078,20 +1443,227 @@ class AccountInvoice(models.Model):
                 self.env.user.notify_warning(message="Error al procesar la solicitud")
                 _logger.debug("Error al procesar la solicitud: %s", e)
 
+    @api.model
+    def _cron_poll_ei_status(self, batch_size=100):
+        """Look for the DIAN status of the production documents without a complete response.
+
+        The documents are queried concurrently, grouped by company, and each one waits twice as long as the previous
+        time before the next query, up to POLL_INTERVAL_MAX minutes. After POLL_MAX_COUNT queries it is left alone,
+        the user can still check it with the status buttons.
+        """
+        auto_commit = not getattr(threading.currentThread(), 'testing', False)
+        polled = self.browse()
+        while True:
+            invoices = self.search([
+                ('ei_uuid', '!=', False),
+                ('ei_is_not_test', '=', True),
+                ('type', 'in', ('out_invoice', 'out_refund')),
+                ('state', 'in', ('open', 'in_payment', 'paid')),
+                '|', ('ei_is_valid', '=', False), ('ei_attached_document_base64_bytes', '=', False),
+                ('ei_poll_count', '<', POLL_MAX_COUNT),
+                '|', ('ei_poll_next_date', '=', False), ('ei_poll_next_date', '<=', fields.Datetime.now()),
+                ('id', 'not in', polled.ids),
+            ], order='ei_poll_next_date, id', limit=batch_size)
+            if not invoices:
+                break
+
+            for company in invoices.mapped('company_id'):
+                invoices.filtered(lambda inv: inv.company_id == company)._poll_ei_status()
+            polled |= invoices
+            if auto_commit:
+                self.env.cr.commit()
+            else:
+                break
+
+    @api.multi
+    def _poll_ei_status(self):
+        """Query the logs of the documents of a company and, if the attached document is still missing, their
+        status. Then schedule the next query of the incomplete ones."""
+        company = self.mapped('company_id')
+        company.ensure_one()
+        if not company.api_key or not company.api_url:
+            return
+        client = jorels_api.get_client(company.api_url)
+        token = company.api_key
+
+        calls = {rec.id: (client.post, ("/api/ubl2.1/logs/" + rec.ei_uuid, token, {})) for rec in self}
+        for invoice_id, response, error in _run_concurrently(calls, company.ei_max_workers):
+            rec = self.browse(invoice_id)
+            if error or not isinstance(response, list):
+                _logger.debug("Error al consultar los logs del documento %s: %s", rec.number, error or response)
+                continue
+            try:
+                with self.env.cr.savepoint():
+                    rec.write_log_response(response)
+            except Exception as e:
+                _logger.debug("Error al procesar los logs del documento %s: %s", rec.number, e)
+
+        missing = self.filtered(lambda inv: not inv.ei_attached_document_base64_bytes)
+        calls = {
+            rec.id: (client.post, ("/api/ubl2.1/status/document/" + rec.ei_uuid, token, {"refresh_pdf": True}))
+            for rec in missing
+        }
+        for invoice_id, response, error in _run_concurrently(calls, company.ei_max_workers):
+            rec = self.browse(invoice_id)
+            if error or 'is_valid' not in response:
+                _logger.debug("Error al consultar el estado del documento %s: %s", rec.number, error or response)
+                continue
+            try:
+                with self.env.cr.savepoint():
+                    rec.write_response(response)
+            except Exception as e:
+                _logger.debug("Error al procesar el estado del documento %s: %s", rec.number, e)
+
+        now = fields.Datetime.now()
+        for rec in self:
+            if rec.ei_is_valid and rec.ei_attached_document_base64_bytes:
+                rec.write({'ei_poll_next_date': False})
+            else:
+                interval = min(POLL_INTERVAL_MIN * 2 ** rec.ei_poll_count, POLL_INTERVAL_MAX)
+                rec.write({
+                    'ei_poll_count': rec.ei_poll_count + 1,
+                    'ei_poll_next_date': now + timedelta(minutes=interval),
+                })
+
     @api.depends('ei_attached_document_base64_bytes')
     def _is_attached_document_matched(self):
+        for rec, matched in self._check_attached_document_matched().items():
+            rec.is_attached_document_matched = matched
+
+    @api.multi
+    def _check_attached_document_matched(self):
+        """Check that the ParentDocumentID of the attached document is the number of the invoice.
+
+        The attached documents are read from the filestore by chunks, up to the ParentDocumentID, without loading
+        them in memory.
+
+        :return: dict {invoice: bool}
+        """
+        attachments = self._get_ei_attachments('ei_attached_document_base64_bytes')
+        result = {}
         for rec in self:
-            if rec.ei_attached_document_base64_bytes:
-                with BytesIO(base64.b64decode(rec.ei_attached_document_base64_bytes)) as file:
-                    search_ok = False
-                    for line in file:
-                        search_string = '<cbc:ParentDocumentID>' + rec.number_formatted + '</cbc:ParentDocumentID>'
-                        if search_string in str(line):
-                            search_ok = True
-                            break
-                    rec.is_attached_document_matched = search_ok
+            attachment = attachments.get(rec.id)
+            if not rec.number_formatted or (rec.id and attachment is None):
+                result[rec] = False
+                continue
+
+            # Solo se lee hasta el primer ParentDocumentID
+            needle = ('<cbc:ParentDocumentID>' + rec.number_formatted + '</cbc:ParentDocumentID>').encode()
+            stop = b'</cbc:ParentDocumentID>'
+            if attachment is not None:
+                with self._open_ei_attachment(attachment) as file:
+                    result[rec] = _stream_contains(file, needle, stop)
             else:
-                rec.is_attached_document_matched = False
+                # Registros nuevos, aún sin adjunto
+                value = rec.ei_attached_document_base64_bytes
+                result[rec] = bool(value) and _stream_contains(BytesIO(base64.b64decode(value)), needle, stop)
+        return result
+
+    @api.multi
+    def _get_ei_attachments(self, field_name):
+        """Return {invoice_id: attachment} with the attachments of a binary field of the invoices"""
+        if not self.ids:
+            return {}
+        return {
+            attachment.res_id: attachment
+            for attachment in self.env['ir.attachment'].sudo().search([
+                ('res_model', '=', self._name),
+                ('res_field', '=', field_name),
+                ('res_id', 'in', self.ids),
+            ])
+        }
+
+    @api.model
+    def _open_ei_attachment(self, attachment):
+        """Return a binary stream with the content of the attachment, read from the filestore when it is there"""
+        if attachment.store_fname:
+            return open(attachment._full_path(attachment.store_fname), 'rb')
+        return BytesIO(base64.b64decode(attachment.datas or b''))
+
+    @api.multi
+    def _extract_attached_document_metadata(self):
+        """Store the CUFE/CUDE, issue date, total, parent document id and DIAN response code of the attached
+        documents, so they can be searched without reading the files"""
+        attachments = self._get_ei_attachments('ei_attached_document_base64_bytes')
+        for rec in self:
+            vals = {
+                'ei_attached_cufe': False,
+                'ei_attached_issue_date': False,
+                'ei_attached_payable_amount': False,
+                'ei_attached_parent_document_id': False,
+                'ei_attached_response_code': False,
+            }
+            attachment = attachments.get(rec.id)
+            if attachment is not None:
+                try:
+                    with self._open_ei_attachment(attachment) as file:
+                        vals.update(_parse_attached_document(file))
+                except (etree.XMLSyntaxError, ValueError) as e:
+                    _logger.warning("No se pudo leer el documento adjunto de la factura %s: %s", rec.number, e)
+            rec.write(vals)
+
+    @api.model
+    def _backfill_attached_document_metadata(self, batch_size=500):
+        """Extract the attached document data of the invoices received before these fields existed.
+
+        The invoices are processed by batches of ids and each batch is committed when running outside of tests.
+        """
+        auto_commit = not getattr(threading.currentThread(), 'testing', False)
+        last_id = 0
+        while True:
+            self.env.cr.execute("""
+                SELECT a.res_id FROM ir_attachment a
+                JOIN account_invoice ai ON ai.id = a.res_id
+                WHERE a.res_model = %s AND a.res_field = 'ei_attached_document_base64_bytes' AND a.res_id > %s
+                    AND ai.ei_attached_parent_document_id IS NULL
+                ORDER BY a.res_id
+                LIMIT %s
+            """, (self._name, last_id, batch_size))
+            ids = [row[0] for row in self.env.cr.fetchall()]
+            if not ids:
+                break
+            last_id = ids[-1]
+
+            self.browse(ids)._extract_attached_document_metadata()
+            self.invalidate_cache()
+            if auto_commit:
+                self.env.cr.commit()
+            _logger.info("Datos de documentos adjuntos extraídos hasta la factura %s", last_id)
+
+    @api.model
+    def _recompute_attached_document_matched(self, batch_size=1000):
+        """Recompute is_attached_document_matched on all the invoices with an attached document.
+
+        The invoices are processed by batches of ids with their own cache, so memory stays bounded on large
+        databases, and each batch is committed when running outside of tests.
+        """
+        auto_commit = not getattr(threading.currentThread(), 'testing', False)
+        last_id = 0
+        while True:
+            self.env.cr.execute("""
+                SELECT a.res_id FROM ir_attachment a
+                JOIN account_invoice ai ON ai.id = a.res_id
+                WHERE a.res_model = %s AND a.res_field = 'ei_attached_document_base64_bytes' AND a.res_id > %s
+                ORDER BY a.res_id
+                LIMIT %s
+            """, (self._name, last_id, batch_size))
+            ids = [row[0] for row in self.env.cr.fetchall()]
+            if not ids:
+                break
+            last_id = ids[-1]
+
+            result = self.browse(ids)._check_attached_document_matched()
+            for matched in (True, False):
+                rec_ids = tuple(rec.id for rec, value in result.items() if value == matched)
+                if rec_ids:
+                    self.env.cr.execute("""
+                        UPDATE account_invoice SET is_attached_document_matched = %s
+                        WHERE id IN %s AND is_attached_document_matched IS DISTINCT FROM %s
+                    """, (matched, rec_ids, matched))
+            self.invalidate_cache()
+            if auto_commit:
+                self.env.cr.commit()
+            _logger.info("Documentos adjuntos verificados hasta la factura %s", last_id)
 
     @api.multi
     def message_update(self, msg_dict, update_vals=None):
@@ -1109,3 +1681,26 @@ class AccountInvoice(models.Model):
             _logger.debug("Mail event. Invoice: %s, Event: %s" % (rec.number_formatted, rec.event))
 
         return res
+
+
+class AccountInvoiceLine(models.Model):
+    _inherit = "account.invoice.line"
+
+    @api.model
+    def create(self, vals):
+        res = super(AccountInvoiceLine, self).create(vals)
+        res.mapped('invoice_id')._invalidate_json_request()
+        return res
+
+    @api.multi
+    def write(self, vals):
+        self.mapped('invoice_id')._invalidate_json_request()
+        res = super(AccountInvoiceLine, self).write(vals)
+        # La línea pudo cambiar de factura
+        self.mapped('invoice_id')._invalidate_json_request()
+        return res
+
+    @api.multi
+    def unlink(self):
+        self.mapped('invoice_id')._invalidate_json_request()
+        return super(AccountInvoiceLine, self).unlink()
@@ -20,10 +20,16 @@
 # email: info@jorels.com
 #
 
-from odoo import fields, models
+from odoo import api, fields, models
 
 
 class AccountTax(models.Model):
     _inherit = "account.tax"
 
     edi_tax_id = fields.Many2one('l10n_co_edi_jorels.taxes', string="Tipo de impuesto (DIAN)", ondelete='RESTRICT')
+
+    @api.multi
+    def write(self, vals):
+        # Los json de las facturas ya construidos en la transacción pueden usar estos datos
+        self.env['account.invoice']._clear_json_request_cache()
+        return super(AccountTax, self).write(vals)
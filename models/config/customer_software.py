@@ -23,7 +23,7 @@
 import re
 import logging
 
-from odoo import fields, models, api
+from odoo import fields, models, api, tools
 
 _logger = logging.getLogger(__name__)
 
@@ -61,69 +61,117 @@ class CustomerSoftware(models.Model):
     number_before = fields.Char("Before")
     number_after = fields.Char("After")
 
+    @api.multi
+    def write(self, vals):
+        res = super(CustomerSoftware, self).write(vals)
+        self.clear_caches()
+        return res
+
+    @api.multi
+    def unlink(self):
+        res = super(CustomerSoftware, self).unlink()
+        self.clear_caches()
+        return res
+
+    @api.multi
+    @tools.ormcache('self.id')
+    def _get_matcher(self):
+        """Return the compiled rules of the customer software, cached until the record changes.
+
+        Only the 'Contains' text of each event is taken into account, the 'Starts with' and 'Ends with' checks
+        always pass.
+
+        :return: tuple (event_rules, number_field, number_regex), event_rules is a tuple of (event, field, text)
+            in the order they are checked
+        """
+        self.ensure_one()
+        event_rules = (
+            ('receipt', self.receipt_event_field, self.receipt_event_find or ''),
+            ('rejection', self.rejection_event_field, self.rejection_event_find or ''),
+            ('acceptance', self.acceptance_event_field, self.acceptance_event_find or ''),
+        )
+        number_regex = re.compile((self.number_before or '') + '(.*)' + (self.number_after or ''))
+        return event_rules, self.number_field, number_regex
+
+    @api.multi
+    def _check_event(self, event, msg_dict):
+        event_rules = self._get_matcher()[0]
+        return any(rule_event == event and text in (msg_dict[field] or '') for rule_event, field, text in event_rules)
+
+    @api.multi
+    def match_message(self, mail_message):
+        """Return the event and the invoice number of the mail message in a single pass over the rules.
+
+        The subject and the body are read at most once, and only if a rule needs them.
+        """
+        self.ensure_one()
+        event_rules, number_field, number_regex = self._get_matcher()
+        texts = {}
+
+        def get_text(field):
+            if field not in texts:
+                texts[field] = mail_message[field] or ''
+            return texts[field]
+
+        event = next((rule_event for rule_event, field, text in event_rules if text in get_text(field)), 'none')
+        return event, self._parse_invoice_number(number_regex, get_text(number_field))
+
+    @api.model
+    def _parse_invoice_number(self, number_regex, search_text):
+        match = number_regex.search(search_text) if search_text else None
+        if match:
+            for res in match.group(1).split(" "):
+                if res:
+                    return res
+        else:
+            _logger.debug("The invoice number does not match in the search")
+
+        return False
+
     @api.multi
     def check_receipt(self, msg_dict):
         self.ensure_one()
-        event_field = self.receipt_event_field
-        ef = self.receipt_event_find if self.receipt_event_find else ''
-        es = self.receipt_event_startswith if self.receipt_event_startswith else ''
-        ee = self.receipt_event_endswith if self.receipt_event_endswith else ''
-        return msg_dict[event_field].find(ef) != -1 \
-               and msg_dict[event_field].startswith(es) != -1 \
-               and msg_dict[event_field].endswith(ee) != -1
+        return self._check_event('receipt', msg_dict)
 
     @api.multi
     def check_rejection(self, msg_dict):
         self.ensure_one()
-        event_field = self.rejection_event_field
-        ef = self.rejection_event_find if self.rejection_event_find else ''
-        es = self.rejection_event_startswith if self.rejection_event_startswith else ''
-        ee = self.rejection_event_endswith if self.rejection_event_endswith else ''
-        return msg_dict[event_field].find(ef) != -1 \
-               and msg_dict[event_field].startswith(es) != -1 \
-               and msg_dict[event_field].endswith(ee) != -11
+        return self._check_event('rejection', msg_dict)
 
     @api.multi
     def check_acceptance(self, msg_dict):
         self.ensure_one()
-        event_field = self.acceptance_event_field
-        ef = self.acceptance_event_find if self.acceptance_event_find else ''
-        es = self.acceptance_event_startswith if self.acceptance_event_startswith else ''
-        ee = self.acceptance_event_endswith if self.acceptance_event_endswith else ''
-        return msg_dict[event_field].find(ef) != -1 \
-               and msg_dict[event_field].startswith(es) != -1 \
-               and msg_dict[event_field].endswith(ee) != -11
+        return self._check_event('acceptance', msg_dict)
 
     @api.multi
     def get_invoice_event(self, msg_dict):
         self.ensure_one()
-        if self.check_receipt(msg_dict):
-            return 'receipt'
-        elif self.check_rejection(msg_dict):
-            return 'rejection'
-        elif self.check_acceptance(msg_dict):
-            return 'acceptance'
-        else:
-            return 'none'
+        for event, field, text in self._get_matcher()[0]:
+            if text in (msg_dict[field] or ''):
+                return event
+        return 'none'
+
+    @api.multi
+    def get_invoice_number(self, mail_message):
+        """Return the invoice number found in the mail message, False if there is none"""
+        self.ensure_one()
+        event_rules, number_field, number_regex = self._get_matcher()
+        search_text = mail_message.subject if number_field == 'subject' else mail_message.body
+        return self._parse_invoice_number(number_regex, search_text)
 
     @api.multi
     def get_invoice_id(self, mail_message):
         """Return invoice_id from mail message"""
         self.ensure_one()
 
-        try:
-            number_before = self.number_before if self.number_before else ''
-            number_after = self.number_after if self.number_after else ''
-            search_text = mail_message.subject if self.number_field == 'subject' else mail_message.body
-            result = re.search(number_before + '(.*)' + number_after, search_text).group(1)
-            for res in result.split(" "):
-                if res:
-                    invoice_number = res
-                    invoice_rec = self.env['account.invoice'].search([('number_formatted', '=', invoice_number)])[0]
-                    return invoice_rec.id
-        except AttributeError:
-            _logger.debug("The invoice number does not match in the search")
-        except IndexError:
+        invoice_number = self.get_invoice_number(mail_message)
+        if invoice_number:
+            invoice_rec = self.env['account.invoice'].search([
+                ('company_id', 'in', self.env.user.company_ids.ids),
+                ('number_formatted', '=', invoice_number),
+            ], limit=1)
+            if invoice_rec:
+                return invoice_rec.id
             _logger.debug("There are no existing invoice numbers")
 
         return False
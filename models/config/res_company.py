@@ -20,12 +20,16 @@
 # email: info@jorels.com
 #
 
+import csv
+import hashlib
 import json
 import logging
-from pathlib import Path
+from io import StringIO
 
-import requests
 from odoo import api, fields, models, tools
+from odoo.modules.module import get_module_resource
+
+from ...tools import jorels_api
 
 _logger = logging.getLogger(__name__)
 
@@ -83,6 +87,22 @@ class ResCompany(models.Model):
                                            default=True)
     enable_mass_send_print = fields.Boolean(string="Email automatico de la factura al validar(En producción)",
                                             default=False)
+    ei_async_validation = fields.Boolean(string="Validación DIAN asíncrona", default=False,
+                                         help="Al confirmar, las facturas quedan en cola y se envían a la DIAN "
+                                              "en segundo plano")
+    ei_max_workers = fields.Integer(string="Envíos simultáneos a la API", default=4,
+                                    help="Cantidad máxima de documentos enviados al mismo tiempo en la validación "
+                                         "por lotes")
+    ei_report_workers = fields.Integer(string="Impresiones simultáneas", default=2,
+                                       help="Partes de 50 facturas que se generan al mismo tiempo al imprimir "
+                                            "muchas facturas, cada una con su propio proceso de wkhtmltopdf")
+
+    _sql_constraints = [
+        ('ei_max_workers_positive', 'CHECK (ei_max_workers > 0)',
+         "Los envíos simultáneos a la API deben ser al menos 1"),
+        ('ei_report_workers_positive', 'CHECK (ei_report_workers > 0)',
+         "Las impresiones simultáneas deben ser al menos 1"),
+    ]
 
     # Report
     report_custom_text = fields.Html(string="Header text")
@@ -235,26 +255,23 @@ class ResCompany(models.Model):
         for rec in self:
             success = False
             try:
-                api_file_path = Path(__file__).parents[2] / 'static' / 'api.json'
-                with open(api_file_path) as api_file:
-                    requests_data = json.loads(api_file.read())
-                requests_data['environment']['type_environment_id'] = environment
+                environment_data = jorels_api.get_request_template('environment')
+                environment_data['type_environment_id'] = environment
                 _logger.debug("Request environment DIAN: %s",
-                              json.dumps(requests_data['environment'], indent=2, sort_keys=False))
+                              json.dumps(environment_data, indent=2, sort_keys=False))
 
                 token = rec.api_key
                 api_url = rec.api_url
 
-                header = {"accept": "application/json", "Content-Type": "application/json"}
-                api_url = api_url + "/api/ubl2.1/config/environment"
-                header.update({'Authorization': 'Bearer ' + token})
-                response = requests.put(api_url, json.dumps(requests_data['environment']), headers=header).json()
+                client = jorels_api.get_client(api_url)
+                path = "/api/ubl2.1/config/environment"
+                response = client.put(path, token, environment_data)
                 _logger.debug('API Response PUT environment: %s', response)
 
                 if 'message' in response:
                     rec.env.user.notify_info(message=response['message'])
 
-                response = requests.get(api_url, headers=header).json()
+                response = client.get(path, token)
                 _logger.debug('API Response GET environment: %s', response)
 
                 if 'type_environment_id' in response:
@@ -271,6 +288,146 @@ class ResCompany(models.Model):
 
             return success
 
+    @api.multi
+    def init_csv_data(self, module_name):
+        # module_name es '<módulo>.<modelo>', el csv es data/<modelo>.csv del módulo
+        if self._load_csv_data_incremental(module_name):
+            res = True
+        else:
+            res = super(ResCompany, self).init_csv_data(module_name)
+            self._save_csv_data_hash(module_name)
+            model_name = module_name.split('.', 1)[-1]
+            if model_name in self.env:
+                self._update_listing_search_names(self.env[model_name])
+        # Los listados de la DIAN pudieron cambiar
+        self.env['l10n_co_edi_jorels.listing_mixin'].clear_caches()
+        return res
+
+    @api.model
+    def _get_csv_data_file(self, csv_name):
+        """Return the model name, path and sha1 of the csv of init_csv_data, None if it doesn't exist"""
+        module, model_name = csv_name.split('.', 1) if '.' in csv_name else (None, None)
+        csv_path = module and get_module_resource(module, 'data', model_name + '.csv')
+        if not csv_path or model_name not in self.env:
+            return None
+        with open(csv_path, 'rb') as csv_file:
+            content = csv_file.read()
+        return model_name, content, hashlib.sha1(content).hexdigest()
+
+    @api.model
+    def _save_csv_data_hash(self, csv_name):
+        csv_data = self._get_csv_data_file(csv_name)
+        if csv_data:
+            model_name, content, csv_hash = csv_data
+            self.env['ir.config_parameter'].sudo().set_param('l10n_co_edi_jorels.csv_hash.' + model_name, csv_hash)
+
+    @api.model
+    def _load_csv_data_incremental(self, csv_name):
+        """Load a listing csv, skipping it when it didn't change since the last time.
+
+        The hash of each csv is kept in a system parameter. When the file changed only its new or modified rows are
+        written, with a single INSERT ... ON CONFLICT (id) DO UPDATE. The values are compared once converted to the
+        type of their column.
+
+        :return: False if the csv can't be loaded this way and init_csv_data must take care of it, as on a fresh
+            install where the table is still empty
+        """
+        csv_data = self._get_csv_data_file(csv_name)
+        if not csv_data:
+            return False
+        model_name, content, csv_hash = csv_data
+        model = self.env[model_name]
+        params = self.env['ir.config_parameter'].sudo()
+        param_key = 'l10n_co_edi_jorels.csv_hash.' + model_name
+
+        # Con la tabla vacía se carga con el ORM, para aplicar los valores por defecto y los create()
+        self._cr.execute('SELECT id FROM "%s" LIMIT 1' % model._table)
+        if not self._cr.fetchone():
+            return False
+        if params.get_param(param_key) == csv_hash:
+            _logger.debug("Listado %s sin cambios", model_name)
+            return True
+
+        reader = csv.reader(StringIO(content.decode('utf-8-sig')))
+        header = next(reader, [])
+        if 'id' not in header:
+            return False
+        # Solo las columnas que existen en la tabla
+        columns = [name for name in header if name != 'id' and name in model._fields
+                   and model._fields[name].store and model._fields[name].column_type]
+        rows = {}
+        try:
+            for line in reader:
+                if line:
+                    row = dict(zip(header, line))
+                    rows[int(row['id'])] = tuple(
+                        self._convert_csv_value(model._fields[name], row[name]) for name in columns)
+        except ValueError as e:
+            _logger.debug("Listado %s: %s", model_name, e)
+            return False
+
+        self._cr.execute('SELECT id, %s FROM "%s"' % (', '.join('"%s"' % name for name in columns), model._table))
+        existing = {
+            row[0]: tuple(self._convert_db_value(model._fields[name], value) for name, value in zip(columns, row[1:]))
+            for row in self._cr.fetchall()
+        }
+        changed = [(row_id,) + values for row_id, values in rows.items() if existing.get(row_id) != values]
+
+        if changed:
+            placeholders = ', '.join(['(' + ', '.join(['%s'] * (len(columns) + 1)) + ', %s, %s, '
+                                      "now() at time zone 'UTC', now() at time zone 'UTC')"] * len(changed))
+            self._cr.execute(
+                'INSERT INTO "%s" (id, %s, create_uid, write_uid, create_date, write_date) VALUES ' % (
+                    model._table, ', '.join('"%s"' % name for name in columns)) + placeholders +
+                ' ON CONFLICT (id) DO UPDATE SET %s' % ', '.join(
+                    '"%s" = EXCLUDED."%s"' % (name, name) for name in columns + ['write_uid', 'write_date']),
+                [value for row in changed for value in row + (self.env.uid, self.env.uid)])
+            self._cr.execute("SELECT setval('%s_id_seq', (SELECT MAX(id) FROM \"%s\"))" % (
+                model._table, model._table))
+            model.invalidate_cache()
+            self._update_listing_search_names(model, [row[0] for row in changed])
+            _logger.info("Listado %s: %s registros actualizados", model_name, len(changed))
+
+        params.set_param(param_key, csv_hash)
+        return True
+
+    @api.model
+    def _update_listing_search_names(self, model, ids=None):
+        """Recompute the search_name of the listing rows loaded without the ORM, all of them if ids is None"""
+        if 'search_name' in model._fields:
+            model._update_search_names(ids)
+        # El nombre del departamento hace parte del de los municipios
+        if model._name == 'l10n_co_edi_jorels.departments':
+            municipalities = self.env['l10n_co_edi_jorels.municipalities']
+            if ids is not None:
+                ids = municipalities.with_context(active_test=False).search([('department_id', 'in', ids)]).ids
+            municipalities._update_search_names(ids)
+
+    @api.model
+    def _convert_csv_value(self, field, value):
+        """Convert a csv literal to the python value of the column, as the database returns it"""
+        if field.type == 'boolean':
+            return value.strip().lower() in ('1', 'true', 't', 'yes')
+        if not value:
+            return None
+        if field.type in ('integer', 'many2one'):
+            return int(value)
+        if field.type in ('float', 'monetary'):
+            return float(value)
+        if field.type == 'date':
+            return fields.Date.to_date(value)
+        if field.type == 'datetime':
+            return fields.Datetime.to_datetime(value)
+        return value
+
+    @api.model
+    def _convert_db_value(self, field, value):
+        if field.type == 'boolean':
+            return bool(value)
+        if value is not None and field.type in ('float', 'monetary'):
+            return float(value)
+        return value
+
     @api.multi
     def write(self, vals):
         for rec in self:
@@ -22,12 +22,12 @@
 
 import json
 import logging
-from pathlib import Path
 
-import requests
 from odoo import api, fields, models
 from odoo.exceptions import Warning
 
+from ...tools import jorels_api
+
 _logger = logging.getLogger(__name__)
 
 
@@ -61,6 +61,12 @@ class ResConfigSettings(models.TransientModel):
     enable_mass_send_print = fields.Boolean(related="company_id.enable_mass_send_print",
                                             string="Email automatico de la factura al validar(En producción)",
                                             default=False, readonly=False)
+    ei_async_validation = fields.Boolean(related="company_id.ei_async_validation",
+                                         string="Validación DIAN asíncrona", readonly=False)
+    ei_max_workers = fields.Integer(related="company_id.ei_max_workers", string="Envíos simultáneos a la API",
+                                    readonly=False)
+    ei_report_workers = fields.Integer(related="company_id.ei_report_workers", string="Impresiones simultáneas",
+                                       readonly=False)
 
     # Report
     report_custom_text = fields.Html(related="company_id.report_custom_text", string="Header text", readonly=False)
@@ -78,10 +84,7 @@ class ResConfigSettings(models.TransientModel):
                 token = rec.api_key
                 api_url = rec.api_url
 
-                header = {"accept": "application/json", "Content-Type": "application/json"}
-                api_url = api_url + "/api/ubl2.1/config/resolutions"
-                header.update({'Authorization': 'Bearer' + ' ' + token})
-                response = requests.get(api_url, headers=header).json()
+                response = jorels_api.get_client(api_url).get("/api/ubl2.1/config/resolutions", token)
                 _logger.debug('API Response: %s', response)
         except Exception as e:
             _logger.debug("Error de conexión: %s", e)
@@ -93,10 +96,7 @@ class ResConfigSettings(models.TransientModel):
             token = str(self.env.user.company_id.api_key)
             api_url = str(self.env.user.company_id.api_url)
 
-            header = {"accept": "application/json", "Content-Type": "application/json"}
-            api_url = api_url + "/api/ubl2.1/config/resolutions"
-            header.update({'Authorization': 'Bearer' + ' ' + token})
-            response = requests.get(api_url, headers=header).json()
+            response = jorels_api.get_client(api_url).get("/api/ubl2.1/config/resolutions", token)
             _logger.debug('API Response: %s', response)
 
             if 'message' in response:
@@ -109,78 +109,9 @@ class ResConfigSettings(models.TransientModel):
                 # First delete resolutions on database
                 # self._cr.execute("""DELETE FROM l10n_co_edi_jorels_resolution""")
 
-                # Now create new resolutions
-                for resolution in response:
-                    if resolution['resolution_date']:
-                        if int(resolution['resolution_date'].split('-')[0]) < 2000:
-                            resolution['resolution_date'] = "'2000-01-01'"
-                        else:
-                            resolution['resolution_date'] = "'" + resolution['resolution_date'] + "'"
-                    else:
-                        resolution['resolution_date'] = 'NULL'
-
-                    if resolution['date_from']:
-                        if int(resolution['date_from'].split('-')[0]) < 2000:
-                            resolution['date_from'] = "'2000-01-01'"
-                        else:
-                            resolution['date_from'] = "'" + resolution['date_from'] + "'"
-                    else:
-                        resolution['date_from'] = 'NULL'
-
-                    if resolution['date_to']:
-                        if int(resolution['date_to'].split('-')[0]) < 2000:
-                            resolution['date_to'] = "'2000-01-01'"
-                        else:
-                            resolution['date_to'] = "'" + resolution['date_to'] + "'"
-                    else:
-                        resolution['date_to'] = 'NULL'
-
-                    # Sincronizando Odoo con la API
-                    resolution_search = self.env['l10n_co_edi_jorels.resolution'].search(
-                        [('resolution_id', '=', resolution['id'])])
-
-                    # TO DO: Actualizar con UPDATE si ya existe
-                    # Si no está ya en la base de datos, entonces la agrega
-                    if not resolution_search:
-                        self._cr.execute(
-                            "INSERT INTO l10n_co_edi_jorels_resolution (" \
-                            "resolution_api_sync," \
-                            "resolution_type_document_id," \
-                            "resolution_prefix," \
-                            "resolution_resolution," \
-                            "resolution_resolution_date," \
-                            "resolution_technical_key," \
-                            "resolution_from," \
-                            "resolution_to," \
-                            "resolution_date_from," \
-                            "resolution_date_to," \
-                            "resolution_id," \
-                            "resolution_number," \
-                            "resolution_next_consecutive," \
-                            "create_uid," \
-                            "create_date," \
-                            "write_uid," \
-                            "write_date" \
-                            ") VALUES (TRUE, %d, '%s', NULLIF('%s','None'), %s, NULLIF('%s','None'), %d, %d, %s, %s, %d, %d, '%s', %d, %s, %d, %s)" %
-                            (
-                                resolution['type_document_id'],
-                                resolution['prefix'],
-                                resolution['resolution'],
-                                resolution['resolution_date'],
-                                resolution['technical_key'],
-                                resolution['from'],
-                                resolution['to'],
-                                resolution['date_from'],
-                                resolution['date_to'],
-                                resolution['id'],
-                                resolution['number'],
-                                resolution['next_consecutive'],
-                                self.env.user.id,
-                                'NOW()',
-                                self.env.user.id,
-                                'NOW()'
-                            )
-                        )
+                # Now create new resolutions and update the existing ones
+                if response:
+                    self._upsert_resolutions(response)
         except Exception as e:
             raise Warning(e)
 
@@ -192,6 +123,74 @@ class ResConfigSettings(models.TransientModel):
             "views": [[False, "tree"], [False, "form"]],
         }
 
+    @api.model
+    def _upsert_resolutions(self, resolutions):
+        """Sync the resolutions of the API with a single statement.
+
+        The resolutions that already exist, by resolution_id, are updated and the new ones are inserted.
+        """
+
+        def api_date(value):
+            # Las fechas anteriores al 2000 de la API se guardan como 2000-01-01
+            if not value:
+                return None
+            return '2000-01-01' if int(value.split('-')[0]) < 2000 else value
+
+        rows = [(
+            resolution['type_document_id'],
+            resolution['prefix'],
+            resolution['resolution'],
+            api_date(resolution['resolution_date']),
+            resolution['technical_key'],
+            resolution['from'],
+            resolution['to'],
+            api_date(resolution['date_from']),
+            api_date(resolution['date_to']),
+            resolution['id'],
+            resolution['number'],
+            resolution['next_consecutive'],
+        ) for resolution in resolutions]
+        values = ', '.join(["(%s::integer, %s::varchar, %s::varchar, %s::date, %s::varchar, %s::integer, %s::integer, "
+                            "%s::date, %s::date, %s::integer, %s::integer, %s::varchar)"] * len(rows))
+        params = [value for row in rows for value in row]
+
+        self._cr.execute("""
+            WITH data (type_document_id, prefix, resolution, resolution_date, technical_key, from_number, to_number,
+                       date_from, date_to, api_id, number, next_consecutive) AS (
+                VALUES """ + values + """
+            ), updated AS (
+                UPDATE l10n_co_edi_jorels_resolution r SET
+                    resolution_type_document_id = d.type_document_id,
+                    resolution_prefix = d.prefix,
+                    resolution_resolution = d.resolution,
+                    resolution_resolution_date = d.resolution_date,
+                    resolution_technical_key = d.technical_key,
+                    resolution_from = d.from_number,
+                    resolution_to = d.to_number,
+                    resolution_date_from = d.date_from,
+                    resolution_date_to = d.date_to,
+                    resolution_number = d.number,
+                    resolution_next_consecutive = d.next_consecutive,
+                    write_uid = %s,
+                    write_date = now() at time zone 'UTC'
+                FROM data d
+                WHERE r.resolution_id = d.api_id
+                RETURNING r.resolution_id
+            )
+            INSERT INTO l10n_co_edi_jorels_resolution (
+                resolution_api_sync, resolution_type_document_id, resolution_prefix, resolution_resolution,
+                resolution_resolution_date, resolution_technical_key, resolution_from, resolution_to,
+                resolution_date_from, resolution_date_to, resolution_id, resolution_number,
+                resolution_next_consecutive, create_uid, create_date, write_uid, write_date
+            )
+            SELECT TRUE, d.type_document_id, d.prefix, d.resolution, d.resolution_date, d.technical_key,
+                d.from_number, d.to_number, d.date_from, d.date_to, d.api_id, d.number, d.next_consecutive,
+                %s, now() at time zone 'UTC', %s, now() at time zone 'UTC'
+            FROM data d
+            WHERE d.api_id NOT IN (SELECT resolution_id FROM updated)
+        """, params + [self.env.uid, self.env.uid, self.env.uid])
+        self.env['l10n_co_edi_jorels.resolution'].invalidate_cache()
+
     # Actualización de entorno
     @api.multi
     def button_put_environment(self):
@@ -202,20 +201,16 @@ class ResConfigSettings(models.TransientModel):
                 else:
                     environment = 2
 
-                api_file_path = Path(__file__).parents[2] / 'static' / 'api.json'
-                with open(api_file_path) as api_file:
-                    requests_data = json.loads(api_file.read())
-                requests_data['environment']['type_environment_id'] = environment
+                environment_data = jorels_api.get_request_template('environment')
+                environment_data['type_environment_id'] = environment
                 _logger.debug("Request environment DIAN: %s",
-                              json.dumps(requests_data['environment'], indent=2, sort_keys=False))
+                              json.dumps(environment_data, indent=2, sort_keys=False))
 
                 token = rec.api_key
                 api_url = rec.api_url
 
-                header = {"accept": "application/json", "Content-Type": "application/json"}
-                api_url = api_url + "/api/ubl2.1/config/environment"
-                header.update({'Authorization': 'Bearer ' + token})
-                response = requests.put(api_url, json.dumps(requests_data['environment']), headers=header).json()
+                response = jorels_api.get_client(api_url).put("/api/ubl2.1/config/environment", token,
+                                                              environment_data)
                 _logger.debug('API Response PUT environment: %s', response)
 
                 if 'message' in response:
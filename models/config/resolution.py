@@ -29,11 +29,11 @@ _logger = logging.getLogger(__name__)
 
 try:
     import json
-    import requests
-    from pathlib import Path
 except Exception as err:
     _logger.debug(err)
 
+from ...tools import jorels_api
+
 
 class Resolution(models.Model):
     _name = 'l10n_co_edi_jorels.resolution'
@@ -108,55 +108,51 @@ class Resolution(models.Model):
     def post_resolution(self, vals):
         success = False
         try:
-            api_file_path = Path(__file__).parents[2] / 'static' / 'api.json'
-            with open(api_file_path) as api_file:
-                requests_data = json.loads(api_file.read())
+            resolution_data = jorels_api.get_request_template('resolucion')
 
-            requests_data['resolucion']['type_document_id'] = vals['resolution_type_document_id']
+            resolution_data['type_document_id'] = vals['resolution_type_document_id']
 
             if vals['resolution_prefix']:
-                requests_data['resolucion']['prefix'] = vals['resolution_prefix']
+                resolution_data['prefix'] = vals['resolution_prefix']
             else:
-                del requests_data['resolucion']['prefix']
+                del resolution_data['prefix']
 
             if vals['resolution_resolution']:
-                requests_data['resolucion']['resolution'] = vals['resolution_resolution']
+                resolution_data['resolution'] = vals['resolution_resolution']
             else:
-                del requests_data['resolucion']['resolution']
+                del resolution_data['resolution']
 
             if vals['resolution_resolution_date']:
-                requests_data['resolucion']['resolution_date'] = vals['resolution_resolution_date']
+                resolution_data['resolution_date'] = vals['resolution_resolution_date']
             else:
-                del requests_data['resolucion']['resolution_date']
+                del resolution_data['resolution_date']
 
             if vals['resolution_technical_key']:
-                requests_data['resolucion']['technical_key'] = vals['resolution_technical_key']
+                resolution_data['technical_key'] = vals['resolution_technical_key']
             else:
-                del requests_data['resolucion']['technical_key']
+                del resolution_data['technical_key']
 
-            requests_data['resolucion']['from'] = vals['resolution_from']
-            requests_data['resolucion']['to'] = vals['resolution_to']
+            resolution_data['from'] = vals['resolution_from']
+            resolution_data['to'] = vals['resolution_to']
 
             if vals['resolution_date_from']:
-                requests_data['resolucion']['date_from'] = vals['resolution_date_from']
+                resolution_data['date_from'] = vals['resolution_date_from']
             else:
-                del requests_data['resolucion']['date_from']
+                del resolution_data['date_from']
 
             if vals['resolution_date_to']:
-                requests_data['resolucion']['date_to'] = vals['resolution_date_to']
+                resolution_data['date_to'] = vals['resolution_date_to']
             else:
-                del requests_data['resolucion']['date_to']
+                del resolution_data['date_to']
 
             _logger.debug("Request create resolution DIAN: %s",
-                          json.dumps(requests_data['resolucion'], indent=2, sort_keys=False))
+                          json.dumps(resolution_data, indent=2, sort_keys=False))
 
             token = str(self.env.user.company_id.api_key)
             api_url = str(self.env.user.company_id.api_url)
 
-            header = {"accept": "application/json", "Content-Type": "application/json"}
-            api_url = api_url + "/api/ubl2.1/config/resolution"
-            header.update({'Authorization': 'Bearer' + ' ' + token})
-            response = requests.post(api_url, json.dumps(requests_data['resolucion']), headers=header).json()
+            response = jorels_api.get_client(api_url).post("/api/ubl2.1/config/resolution", token,
+                                                           resolution_data)
             _logger.debug('API Response: %s', response)
 
             if 'resolution' in response:
@@ -184,55 +180,51 @@ class Resolution(models.Model):
         success = False
         for rec in self:
             try:
-                api_file_path = Path(__file__).parents[2] / 'static' / 'api.json'
-                with open(api_file_path) as api_file:
-                    requests_data = json.loads(api_file.read())
+                resolution_data = jorels_api.get_request_template('resolucion')
 
                 # Resolution api id for update
                 resolution_id = str(rec.resolution_id)
 
-                requests_data['resolucion']['type_document_id'] = rec.resolution_type_document_id.id
-                requests_data['resolucion']['prefix'] = rec.resolution_prefix
-                requests_data['resolucion']['resolution'] = rec.resolution_resolution
-                requests_data['resolucion']['resolution_date'] = fields.Date.to_string(rec.resolution_resolution_date)
-                requests_data['resolucion']['technical_key'] = rec.resolution_technical_key
-                requests_data['resolucion']['from'] = rec.resolution_from
-                requests_data['resolucion']['to'] = rec.resolution_to
-                requests_data['resolucion']['date_from'] = fields.Date.to_string(rec.resolution_date_from)
-                requests_data['resolucion']['date_to'] = fields.Date.to_string(rec.resolution_date_to)
+                resolution_data['type_document_id'] = rec.resolution_type_document_id.id
+                resolution_data['prefix'] = rec.resolution_prefix
+                resolution_data['resolution'] = rec.resolution_resolution
+                resolution_data['resolution_date'] = fields.Date.to_string(rec.resolution_resolution_date)
+                resolution_data['technical_key'] = rec.resolution_technical_key
+                resolution_data['from'] = rec.resolution_from
+                resolution_data['to'] = rec.resolution_to
+                resolution_data['date_from'] = fields.Date.to_string(rec.resolution_date_from)
+                resolution_data['date_to'] = fields.Date.to_string(rec.resolution_date_to)
 
                 len_prefix = len('resolution_')
                 for val in vals:
-                    requests_data['resolucion'][val[len_prefix:]] = vals[val]
+                    resolution_data[val[len_prefix:]] = vals[val]
 
-                if not requests_data['resolucion']['prefix']:
-                    requests_data['resolucion']['prefix'] = ''
+                if not resolution_data['prefix']:
+                    resolution_data['prefix'] = ''
 
-                if not requests_data['resolucion']['resolution']:
-                    requests_data['resolucion']['resolution'] = ''
+                if not resolution_data['resolution']:
+                    resolution_data['resolution'] = ''
 
-                if not requests_data['resolucion']['resolution_date']:
-                    requests_data['resolucion']['resolution_date'] = ''
+                if not resolution_data['resolution_date']:
+                    resolution_data['resolution_date'] = ''
 
-                if not requests_data['resolucion']['technical_key']:
-                    requests_data['resolucion']['technical_key'] = ''
+                if not resolution_data['technical_key']:
+                    resolution_data['technical_key'] = ''
 
-                if not requests_data['resolucion']['date_from']:
-                    requests_data['resolucion']['date_from'] = ''
+                if not resolution_data['date_from']:
+                    resolution_data['date_from'] = ''
 
-                if not requests_data['resolucion']['date_to']:
-                    requests_data['resolucion']['date_to'] = ''
+                if not resolution_data['date_to']:
+                    resolution_data['date_to'] = ''
 
                 _logger.debug("Request update resolution DIAN: %s",
-                              json.dumps(requests_data['resolucion'], indent=2, sort_keys=False))
+                              json.dumps(resolution_data, indent=2, sort_keys=False))
 
                 token = str(self.env.user.company_id.api_key)
                 api_url = str(self.env.user.company_id.api_url)
 
-                header = {"accept": "application/json", "Content-Type": "application/json"}
-                api_url = api_url + "/api/ubl2.1/config/resolution/" + resolution_id
-                header.update({'Authorization': 'Bearer' + ' ' + token})
-                response = requests.put(api_url, json.dumps(requests_data['resolucion']), headers=header).json()
+                response = jorels_api.get_client(api_url).put("/api/ubl2.1/config/resolution/" + resolution_id, token,
+                                                              resolution_data)
                 _logger.debug('API Response: %s', response)
 
                 if 'resolution' in response:
@@ -267,10 +259,8 @@ class Resolution(models.Model):
                 token = str(self.env.user.company_id.api_key)
                 api_url = str(self.env.user.company_id.api_url)
 
-                header = {"accept": "application/json", "Content-Type": "application/json"}
-                api_url = api_url + "/api/ubl2.1/config/resolution/" + str(resolution_id)
-                header.update({'Authorization': 'Bearer' + ' ' + token})
-                response = requests.delete(api_url, headers=header).json()
+                response = jorels_api.get_client(api_url).delete("/api/ubl2.1/config/resolution/" + str(resolution_id),
+                                                                 token)
                 _logger.debug('API Response: %s', response)
 
                 if 'message' in response:
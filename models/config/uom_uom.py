@@ -20,7 +20,7 @@
 # email: info@jorels.com
 #
 
-from odoo import fields, models
+from odoo import api, fields, models
 
 
 class ProductUom(models.Model):
@@ -28,3 +28,9 @@ class ProductUom(models.Model):
 
     edi_unit_measure_id = fields.Many2one(comodel_name='l10n_co_edi_jorels.unit_measures',
                                           string="Unidad de medida (DIAN)", ondelete='RESTRICT')
+
+    @api.multi
+    def write(self, vals):
+        # Los json de las facturas ya construidos en la transacción pueden usar estos datos
+        self.env['account.invoice']._clear_json_request_cache()
+        return super(ProductUom, self).write(vals)
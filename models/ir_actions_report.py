@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+#
+# Jorels S.A.S. - Copyright (2019-2021)
+#
+# This file is part of l10n_co_edi_jorels.
+#
+# l10n_co_edi_jorels is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# l10n_co_edi_jorels is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with l10n_co_edi_jorels.  If not, see <https://www.gnu.org/licenses/>.
+#
+# email: info@jorels.com
+#
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import odoo
+from PyPDF2 import PdfFileReader, PdfFileWriter
+from odoo import api, models, tools
+
+_logger = logging.getLogger(__name__)
+
+# Facturas por cada PDF parcial al imprimir muchas en paralelo
+REPORT_CHUNK_SIZE = 50
+
+
+class IrActionsReport(models.Model):
+    _inherit = 'ir.actions.report'
+
+    @api.multi
+    def render_qweb_pdf(self, res_ids=None, data=None):
+        if self.model != 'account.invoice' or not res_ids or isinstance(res_ids, int):
+            return super(IrActionsReport, self).render_qweb_pdf(res_ids, data)
+
+        if len(res_ids) > REPORT_CHUNK_SIZE and not data and self._can_render_in_chunks():
+            return self._render_invoices_in_chunks(res_ids), 'pdf'
+
+        self.env['account.invoice'].browse(res_ids)._prefetch_ei_report()
+        return super(IrActionsReport, self).render_qweb_pdf(res_ids, data)
+
+    @api.multi
+    def _can_render_in_chunks(self):
+        # Los hilos usan su propio cursor, solo ven los datos confirmados en la base de datos
+        return not self.env.context.get('ei_report_chunk') \
+            and not tools.config['test_enable'] \
+            and not getattr(threading.currentThread(), 'testing', False) \
+            and not self._has_pending_writes()
+
+    @api.model
+    def _has_pending_writes(self):
+        """True if the current transaction already wrote in the database, e.g. invoices validated and then
+        printed. The chunks rendered by other cursors wouldn't see those changes."""
+        try:
+            with self.env.cr.savepoint():
+                # PostgreSQL 10+: la transacción solo tiene un id asignado si ya escribió algo
+                self.env.cr.execute("SELECT txid_current_if_assigned()")
+                return self.env.cr.fetchone()[0] is not None
+        except Exception:
+            # Sin forma de saberlo se imprime en la misma transacción
+            return True
+
+    @api.multi
+    def _render_invoices_in_chunks(self, res_ids):
+        """Render the invoices by chunks in worker threads and merge the PDFs in the original order.
+
+        Each thread has its own cursor and its own wkhtmltopdf process, the chunks are rendered with the batch
+        prefetch of render_qweb_pdf. Only used when the current transaction has no pending writes, the threads
+        only see committed data.
+        """
+        self.ensure_one()
+        chunks = [res_ids[i:i + REPORT_CHUNK_SIZE] for i in range(0, len(res_ids), REPORT_CHUNK_SIZE)]
+        max_workers = max(self.env.user.company_id.ei_report_workers, 1)
+        _logger.info("Reporte %s: %s documentos en %s partes", self.report_name, len(res_ids), len(chunks))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pdfs = list(executor.map(self._render_chunk_in_thread, chunks))
+
+        writer = PdfFileWriter()
+        readers = []
+        for pdf in pdfs:
+            reader = PdfFileReader(BytesIO(pdf), strict=False)
+            readers.append(reader)
+            for page in range(reader.getNumPages()):
+                writer.addPage(reader.getPage(page))
+        stream = BytesIO()
+        writer.write(stream)
+        return stream.getvalue()
+
+    @api.multi
+    def _render_chunk_in_thread(self, res_ids):
+        with api.Environment.manage(), odoo.registry(self.env.cr.dbname).cursor() as cr:
+            env = api.Environment(cr, self.env.uid, dict(self.env.context, ei_report_chunk=True))
+            return env[self._name].browse(self.id).render_qweb_pdf(res_ids)[0]
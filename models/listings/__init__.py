@@ -20,6 +20,8 @@
 # email: info@jorels.com
 #
 
+from . import listing_mixin
+from . import search_name_mixin
 from . import languages
 from . import correction_concepts
 from . import countries
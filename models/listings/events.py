@@ -29,6 +29,7 @@ _logger = logging.getLogger(__name__)
 
 class Events(models.Model):
     _name = "l10n_co_edi_jorels.events"
+    _inherit = "l10n_co_edi_jorels.listing_mixin"
     _description = "Events"
 
     # "id", "name", "code"
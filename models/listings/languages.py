@@ -29,6 +29,7 @@ _logger = logging.getLogger(__name__)
 
 class Languages(models.Model):
     _name = "l10n_co_edi_jorels.languages"
+    _inherit = "l10n_co_edi_jorels.listing_mixin"
     _description = "Idiomas"
 
     # "id", "name", "code"
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+#
+# Jorels S.A.S. - Copyright (2019-2021)
+#
+# This file is part of l10n_co_edi_jorels.
+#
+# l10n_co_edi_jorels is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# l10n_co_edi_jorels is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with l10n_co_edi_jorels.  If not, see <https://www.gnu.org/licenses/>.
+#
+# email: info@jorels.com
+#
+
+import logging
+
+from odoo import api, models, tools
+
+_logger = logging.getLogger(__name__)
+
+
+class ListingMixin(models.AbstractModel):
+    _name = "l10n_co_edi_jorels.listing_mixin"
+    _description = "Listado de la DIAN"
+
+    @api.model
+    @tools.ormcache()
+    def _get_code_map(self):
+        """Return {code: id} of the listing, cached in the registry until the listing changes.
+
+        When a code is repeated the record with the lowest id is used, like the first result of a search.
+        """
+        code_map = {}
+        for record in self.sudo().search_read([], ['code'], order='id'):
+            if record['code']:
+                code_map.setdefault(record['code'], record['id'])
+        return code_map
+
+    @api.model
+    def get_id_by_code(self, code):
+        """Return the id of the record with the code, False if there is none"""
+        return self._get_code_map().get(code, False)
+
+    @api.model
+    def create(self, vals):
+        res = super(ListingMixin, self).create(vals)
+        self.clear_caches()
+        return res
+
+    @api.multi
+    def write(self, vals):
+        res = super(ListingMixin, self).write(vals)
+        self.clear_caches()
+        return res
+
+    @api.multi
+    def unlink(self):
+        res = super(ListingMixin, self).unlink()
+        self.clear_caches()
+        return res
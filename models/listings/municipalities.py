@@ -22,16 +22,25 @@
 
 import logging
 
-from odoo import fields, models
+from odoo import api, fields, models
 
 _logger = logging.getLogger(__name__)
 
 
 class Municipalities(models.Model):
     _name = "l10n_co_edi_jorels.municipalities"
-    _inherit = "l10n_co_edi_jorels.languages"
+    _inherit = ["l10n_co_edi_jorels.languages", "l10n_co_edi_jorels.search_name_mixin"]
     _description = "Municipios"
     _order = "name"
 
     department_id = fields.Many2one(comodel_name='l10n_co_edi_jorels.departments', string="Departamento", required=True,
                                     readonly=True, index=True, ondelete='RESTRICT')
+
+    @api.depends('name', 'code', 'department_id.name')
+    def _compute_search_name(self):
+        super(Municipalities, self)._compute_search_name()
+
+    @api.multi
+    def _get_search_name_parts(self):
+        # Se puede buscar el municipio por el nombre de su departamento
+        return super(Municipalities, self)._get_search_name_parts() + [self.department_id.name]
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+#
+# Jorels S.A.S. - Copyright (2019-2021)
+#
+# This file is part of l10n_co_edi_jorels.
+#
+# l10n_co_edi_jorels is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# l10n_co_edi_jorels is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with l10n_co_edi_jorels.  If not, see <https://www.gnu.org/licenses/>.
+#
+# email: info@jorels.com
+#
+
+import logging
+import unicodedata
+
+from odoo import api, fields, models, tools
+
+_logger = logging.getLogger(__name__)
+
+
+def normalize_search_name(value):
+    """Lowercase text without accents, e.g. 'Medellín' -> 'medellin'"""
+    value = unicodedata.normalize('NFKD', value or '')
+    return ''.join(char for char in value if not unicodedata.combining(char)).lower().strip()
+
+
+class SearchNameMixin(models.AbstractModel):
+    _name = "l10n_co_edi_jorels.search_name_mixin"
+    _description = "Búsqueda rápida por nombre"
+
+    search_name = fields.Char(string="Nombre normalizado", compute='_compute_search_name', store=True, readonly=True)
+
+    @api.depends('name', 'code')
+    def _compute_search_name(self):
+        for rec in self:
+            rec.search_name = rec._get_search_name()
+
+    @api.multi
+    def _get_search_name(self):
+        """Return the normalized text searched by name_search, the models can add more parts to it"""
+        self.ensure_one()
+        return normalize_search_name(' '.join(filter(None, self._get_search_name_parts())))
+
+    @api.multi
+    def _get_search_name_parts(self):
+        self.ensure_one()
+        return [self.name, self.code]
+
+    @api.model_cr_context
+    def _auto_init(self):
+        res = super(SearchNameMixin, self)._auto_init()
+        if self._abstract:
+            return res
+        # Prefijos con LIKE 'texto%', y cualquier parte del nombre si está disponible pg_trgm
+        tools.create_index(self._cr, '%s_search_name_prefix_index' % self._table, self._table,
+                           ['search_name varchar_pattern_ops'])
+        self._cr.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        if self._cr.fetchone():
+            self._cr.execute('CREATE INDEX IF NOT EXISTS "%s_search_name_trgm_index" ON "%s" '
+                             'USING gin (search_name gin_trgm_ops)' % (self._table, self._table))
+        return res
+
+    @api.model
+    def _update_search_names(self, ids=None):
+        """Recompute search_name after loading rows without the ORM, all of them if ids is None.
+
+        The values that changed are written with a single UPDATE, without going through write().
+        """
+        records = self.browse(ids) if ids is not None else self.with_context(active_test=False).search([])
+        rows = []
+        for rec in records:
+            value = rec._get_search_name()
+            if value != rec.search_name:
+                rows.append((rec.id, value))
+        if not rows:
+            return
+        self._cr.execute(
+            'UPDATE "%s" t SET search_name = v.search_name FROM (VALUES %s) AS v (id, search_name) '
+            'WHERE t.id = v.id' % (self._table, ', '.join(['(%s::integer, %s::varchar)'] * len(rows))),
+            [value for row in rows for value in row])
+        self.invalidate_cache(['search_name'], [rec_id for rec_id, value in rows])
+
+    @api.model
+    def name_search(self, name='', args=None, operator='ilike', limit=100):
+        if not name or operator != 'ilike':
+            return super(SearchNameMixin, self).name_search(name, args, operator, limit)
+
+        # Sin caché de resultados: la columna indexada ya responde rápido, y cada texto escrito en un campo
+        # ocuparía una entrada en la caché compartida del registro
+        ids = self._search_ids_by_name(normalize_search_name(name), args or [], limit)
+        return self.browse(ids).name_get()
+
+    @api.model
+    def _search_ids_by_name(self, normalized, args, limit):
+        """Return the ids whose search_name starts with the text, then the ones that contain it"""
+        ids = self._search(list(args) + [('search_name', '=like', _escape_like(normalized) + '%')], limit=limit)
+        if limit is None or len(ids) < limit:
+            ids = list(ids) + list(self._search(
+                list(args) + [('search_name', 'like', normalized), ('id', 'not in', list(ids))],
+                limit=limit - len(ids) if limit else None))
+        return ids
+
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
@@ -29,6 +29,6 @@ _logger = logging.getLogger(__name__)
 
 class UnitMeasures(models.Model):
     _name = "l10n_co_edi_jorels.unit_measures"
-    _inherit = "l10n_co_edi_jorels.languages"
+    _inherit = ["l10n_co_edi_jorels.languages", "l10n_co_edi_jorels.search_name_mixin"]
 
     _description = "Unidades de medida"
@@ -27,6 +27,9 @@ from odoo import api, models
 
 _logger = logging.getLogger(__name__)
 
+# Mensajes procesados con una misma búsqueda de contactos y facturas
+EVENTS_BATCH_SIZE = 1000
+
 
 class Message(models.Model):
     _inherit = 'mail.message'
@@ -34,33 +37,81 @@ class Message(models.Model):
 
     @api.multi
     def search_invoice_events(self):
+        """Link the DIAN event emails to their invoices and update the invoice events.
+
+        The messages are processed by batches: the senders, customer software and invoices of a batch are searched
+        at once, and the messages and invoices are updated with one write for each invoice or event.
+        """
+        for i in range(0, len(self), EVENTS_BATCH_SIZE):
+            self[i:i + EVENTS_BATCH_SIZE]._search_invoice_events_batch()
+
+    @api.multi
+    def _search_invoice_events_batch(self):
+        email_froms = {}
         for rec in self:
-            email_from_search = re.search('<(.*)>', rec.email_from)
+            email_from_search = re.search('<(.*)>', rec.email_from) if rec.email_from else None
             if email_from_search:
-                email_from = email_from_search.group(1)
+                email_froms[rec] = email_from_search.group(1)
             elif rec.email_from:
-                email_from = rec.email_from
-            else:
-                email_from = ''
-
-            if email_from:
-                partner_rec = self.env['res.partner'].search([('email', '=', email_from)])
-                if partner_rec:
-                    cs = partner_rec.customer_software_id
-                    invoice_id = cs.get_invoice_id(rec)
-                    if invoice_id:
-                        rec.res_id = invoice_id
-                        rec.model = 'account.invoice'
-                        invoice_rec = self.env[rec.model].search([('id', '=', rec.res_id)])[0]
-                        if invoice_rec.event != 'acceptance':
-                            invoice_rec.write({
-                                'event': cs.get_invoice_event(rec)
-                            })
-                        else:
-                            _logger.debug("The event status of the invoice cannot be changed")
-                    else:
-                        _logger.debug("Invoice ID does not exist in message ID: %s" % rec.message_id)
-                else:
-                    _logger.debug("It does not match the email of the contacts in the message ID: %s" % rec.message_id)
+                email_froms[rec] = rec.email_from
             else:
                 _logger.debug("Not email from in message")
+
+        # Remitente -> contactos
+        partners = {}
+        for partner in self.env['res.partner'].search([('email', 'in', list(set(email_froms.values())))]):
+            partners[partner.email] = partners.get(partner.email, partner.browse()) | partner
+
+        numbers = {}
+        for rec, email_from in email_froms.items():
+            # Varios contactos pueden compartir el email, deben tener el mismo customer software
+            cs = partners[email_from].mapped('customer_software_id') if email_from in partners else None
+            if cs is None:
+                _logger.debug("It does not match the email of the contacts in the message ID: %s" % rec.message_id)
+            elif len(cs) != 1:
+                _logger.debug("The contacts of the message ID %s don't have a single customer software"
+                              % rec.message_id)
+            else:
+                event, number = cs.match_message(rec)
+                if number:
+                    numbers[rec] = (event, number)
+
+        # Número -> factura, la primera en el orden de búsqueda
+        invoices = {}
+        for invoice in self.env['account.invoice'].search([
+            ('company_id', 'in', self.env.user.company_ids.ids),
+            ('number_formatted', 'in', list({number for event, number in numbers.values()})),
+        ]):
+            invoices.setdefault(invoice.number_formatted, invoice)
+
+        messages_by_invoice = {}
+        for rec in self:
+            if rec not in numbers:
+                continue
+            event, number = numbers[rec]
+            invoice = invoices.get(number)
+            if invoice:
+                messages_by_invoice.setdefault(invoice, []).append((rec, event))
+            else:
+                _logger.debug("Invoice ID does not exist in message ID: %s" % rec.message_id)
+
+        invoices_by_event = {}
+        for invoice, messages in messages_by_invoice.items():
+            self.browse([rec.id for rec, message_event in messages]).write({
+                'res_id': invoice.id,
+                'model': 'account.invoice',
+            })
+
+            # Los eventos se aplican en el orden de los mensajes, la aceptación es definitiva
+            event = invoice.event
+            for rec, message_event in messages:
+                if event != 'acceptance':
+                    event = message_event
+                else:
+                    _logger.debug("The event status of the invoice cannot be changed")
+            if event != invoice.event:
+                invoices_by_event.setdefault(event, invoice.browse())
+                invoices_by_event[event] |= invoice
+
+        for event, event_invoices in invoices_by_event.items():
+            event_invoices.write({'event': event})
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+#
+# Jorels S.A.S. - Copyright (2019-2021)
+#
+# This file is part of l10n_co_edi_jorels.
+#
+# l10n_co_edi_jorels is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# l10n_co_edi_jorels is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with l10n_co_edi_jorels.  If not, see <https://www.gnu.org/licenses/>.
+#
+# email: info@jorels.com
+#
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import odoo
+from odoo import api, fields, models
+
+from .account_invoice import POLL_MAX_COUNT
+
+_logger = logging.getLogger(__name__)
+
+# Minutos tras los que un envío que quedó en curso, por ejemplo tras reiniciar el servidor, vuelve a la cola
+SENDING_TIMEOUT = 60
+
+
+class MailSubmission(models.Model):
+    _name = "l10n_co_edi_jorels.mail_submission"
+    _description = "Cola de correos de facturas electrónicas"
+    _order = "id desc"
+
+    invoice_id = fields.Many2one(comodel_name='account.invoice', string="Documento", required=True, readonly=True,
+                                 index=True, ondelete='cascade')
+    company_id = fields.Many2one(related='invoice_id.company_id', string="Compañía", store=True, readonly=True)
+    user_id = fields.Many2one(comodel_name='res.users', string="Usuario", required=True, readonly=True,
+                              default=lambda self: self.env.user, ondelete='cascade')
+    state = fields.Selection([
+        ('pending', 'Pendiente'),
+        ('sending', 'Enviando'),
+        ('done', 'Enviado'),
+        ('error', 'Error'),
+    ], string="Estado", default='pending', required=True, readonly=True, index=True)
+    attempts = fields.Integer(string="Intentos", readonly=True)
+    message = fields.Text(string="Mensaje", readonly=True)
+    date_done = fields.Datetime(string="Fecha de envío", readonly=True)
+
+    @api.model
+    def enqueue(self, invoices):
+        """Add the invoices to the queue, unless they are already waiting in it"""
+        queued = self.sudo().search([('invoice_id', 'in', invoices.ids), ('state', 'in', ('pending', 'sending'))])
+        to_queue = invoices - queued.mapped('invoice_id')
+        for invoice in to_queue:
+            self.sudo().create({'invoice_id': invoice.id, 'user_id': self.env.user.id})
+        if to_queue:
+            self.env.user.notify_info(message="Documentos en cola para enviar por correo: %s" % len(to_queue))
+        return to_queue
+
+    @api.multi
+    def action_retry(self):
+        self.filtered(lambda entry: entry.state == 'error').write({'state': 'pending'})
+
+    @api.model
+    def _cron_process_queue(self, batch_size=50):
+        """Send the emails of the pending documents.
+
+        A document is ready once its attached document arrived, or when the status poller gave up looking for it.
+        Each batch is claimed and committed first, then split between worker threads, each one with its own
+        cursor, which render the PDF, build the email and commit document by document. The users are notified
+        of the progress after every batch.
+        """
+        auto_commit = not getattr(threading.currentThread(), 'testing', False)
+        self.env.cr.execute("""
+            UPDATE l10n_co_edi_jorels_mail_submission SET state = 'pending'
+            WHERE state = 'sending' AND write_date < (now() at time zone 'UTC') - interval '1 minute' * %s
+        """, (SENDING_TIMEOUT,))
+
+        while True:
+            self.env.cr.execute("""
+                UPDATE l10n_co_edi_jorels_mail_submission SET state = 'sending', write_date = now() at time zone 'UTC'
+                WHERE id IN (
+                    SELECT s.id FROM l10n_co_edi_jorels_mail_submission s
+                    JOIN account_invoice ai ON ai.id = s.invoice_id
+                    WHERE s.state = 'pending' AND (
+                        ai.ei_poll_next_date IS NULL OR ai.ei_poll_count >= %s OR EXISTS (
+                            SELECT 1 FROM ir_attachment a
+                            WHERE a.res_model = 'account.invoice' AND a.res_id = ai.id
+                                AND a.res_field = 'ei_attached_document_base64_bytes'))
+                    ORDER BY s.id
+                    LIMIT %s
+                    FOR UPDATE OF s SKIP LOCKED)
+                RETURNING id
+            """, (POLL_MAX_COUNT, batch_size))
+            entries = self.browse(sorted(row[0] for row in self.env.cr.fetchall()))
+            self.invalidate_cache(['state'], entries.ids)
+            if not entries:
+                break
+
+            if auto_commit:
+                self.env.cr.commit()
+                max_workers = max(entries.mapped('company_id.ei_max_workers') + [1])
+                chunks = [entries.ids[i::max_workers] for i in range(max_workers)]
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    for future in [executor.submit(self._send_in_thread, chunk) for chunk in chunks if chunk]:
+                        future.result()
+                # Nueva transacción para ver lo que guardaron los hilos
+                self.env.cr.commit()
+                self.invalidate_cache()
+            else:
+                entries._send()
+
+            entries._notify_progress()
+            if not auto_commit:
+                break
+
+    @api.model
+    def _send_in_thread(self, entry_ids):
+        with api.Environment.manage(), odoo.registry(self.env.cr.dbname).cursor() as cr:
+            env = api.Environment(cr, self.env.uid, self.env.context)
+            env[self._name].browse(entry_ids)._send(auto_commit=True)
+
+    @api.multi
+    def _send(self, auto_commit=False):
+        """Render the PDF and send the email of each entry with the user who confirmed the document"""
+        attached_documents = self.mapped('invoice_id')._get_ei_attachments('ei_attached_document_base64_bytes')
+        for entry in self:
+            invoice = entry.invoice_id.sudo(entry.user_id)
+            try:
+                with self.env.cr.savepoint():
+                    invoice.mass_send_print()
+                entry.write({
+                    'state': 'done',
+                    'attempts': entry.attempts + 1,
+                    'message': False if invoice.id in attached_documents else
+                    "Enviado sin documento adjunto (attached document)",
+                    'date_done': fields.Datetime.now(),
+                })
+            except Exception as e:
+                _logger.error("Error al enviar el correo del documento %s: %s", invoice.number, e)
+                entry.write({'state': 'error', 'attempts': entry.attempts + 1, 'message': str(e)})
+            if auto_commit:
+                self.env.cr.commit()
+
+    @api.multi
+    def _notify_progress(self):
+        """Notify each user of the entries how many of their documents were sent and how many are left"""
+        for user in self.mapped('user_id'):
+            user_entries = self.filtered(lambda entry: entry.user_id == user)
+            done = len(user_entries.filtered(lambda entry: entry.state == 'done'))
+            failed = len(user_entries.filtered(lambda entry: entry.state == 'error'))
+            pending = self.search_count([('user_id', '=', user.id), ('state', 'in', ('pending', 'sending'))])
+            message = "Correos enviados: %s. Pendientes: %s" % (done, pending)
+            if failed:
+                user.notify_warning(message=message + ". Con errores: %s" % failed)
+            else:
+                user.notify_info(message=message)
@@ -21,9 +21,9 @@
 #
 
 import base64
-import tempfile
+import hashlib
 import zipfile
-from pathlib import Path
+from io import BytesIO
 
 from odoo import models, api
 from odoo.tools import pycompat
@@ -53,38 +53,28 @@ class MailTemplate(models.Model):
                     and invoice.type in ('out_invoice', 'out_refund') \
                     and invoice.state in ('open', 'paid'):
 
-                pdf_name = invoice.ei_uuid + '.pdf'
-                pdf_path = Path(tempfile.gettempdir()) / pdf_name
-
-                xml_name = invoice.ei_uuid + '.xml'
-                xml_path = Path(tempfile.gettempdir()) / xml_name
-
-                zip_name = invoice.ei_uuid + '.zip'
-                zip_path = Path(tempfile.gettempdir()) / zip_name
-
-                zip_archive = zipfile.ZipFile(zip_path, 'w')
-
-                pdf_handle = open(pdf_path, 'wb')
-                pdf_handle.write(base64.decodebytes(res[res_id]["attachments"][0][1]))
-                pdf_handle.close()
-                zip_archive.write(pdf_path, arcname=pdf_name)
-
-                if invoice.ei_attached_document_base64_bytes:
-                    xml_handle = open(xml_path, 'wb')
-                    xml_handle.write(base64.decodebytes(invoice.ei_attached_document_base64_bytes))
-                    xml_handle.close()
-                    zip_archive.write(xml_path, arcname=xml_name)
-
-                zip_archive.close()
-
-                if invoice.ei_attached_document_base64_bytes:
-                    with open(zip_path, 'rb') as f:
-                        attached_zip = f.read()
-                        ei_attached_zip_base64_bytes = base64.encodebytes(attached_zip)
-                        attachments += [(zip_name, ei_attached_zip_base64_bytes)]
+                attached_document = invoice._get_ei_attachments('ei_attached_document_base64_bytes').get(invoice.id)
+                if attached_document is not None:
+                    zip_name = invoice.ei_uuid + '.zip'
+                    pdf = base64.b64decode(res[res_id]["attachments"][0][1])
+
+                    # El zip se reutiliza mientras el PDF y el documento adjunto sean los mismos
+                    checksum = hashlib.sha1(
+                        (hashlib.sha1(pdf).hexdigest() + attached_document.checksum).encode()).hexdigest()
+                    if invoice.ei_attached_zip_checksum == checksum and invoice.ei_attached_zip_base64_bytes:
+                        ei_attached_zip_base64_bytes = invoice.ei_attached_zip_base64_bytes
+                    else:
+                        zip_buffer = BytesIO()
+                        with zipfile.ZipFile(zip_buffer, 'w') as zip_archive:
+                            zip_archive.writestr(invoice.ei_uuid + '.pdf', pdf)
+                            with invoice._open_ei_attachment(attached_document) as xml_file:
+                                zip_archive.writestr(invoice.ei_uuid + '.xml', xml_file.read())
+                        ei_attached_zip_base64_bytes = base64.encodebytes(zip_buffer.getvalue())
                         invoice.write({
-                            'ei_attached_zip_base64_bytes': ei_attached_zip_base64_bytes
+                            'ei_attached_zip_base64_bytes': ei_attached_zip_base64_bytes,
+                            'ei_attached_zip_checksum': checksum,
                         })
+                    attachments += [(zip_name, ei_attached_zip_base64_bytes)]
 
             res[res_id]["attachments"] = attachments
 
@@ -22,7 +22,7 @@
 
 import logging
 
-from odoo import fields, models
+from odoo import api, fields, models
 
 _logger = logging.getLogger(__name__)
 
@@ -43,3 +43,9 @@ class ResPartner(models.Model):
 
     customer_software_id = fields.Many2one(comodel_name='l10n_co_edi_jorels.customer_software',
                                            string="Customer software", copy=False, ondelete='RESTRICT')
+
+    @api.multi
+    def write(self, vals):
+        # Los json de las facturas ya construidos en la transacción pueden usar estos datos
+        self.env['account.invoice']._clear_json_request_cache()
+        return super(ResPartner, self).write(vals)
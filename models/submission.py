@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+#
+# Jorels S.A.S. - Copyright (2019-2021)
+#
+# This file is part of l10n_co_edi_jorels.
+#
+# l10n_co_edi_jorels is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# l10n_co_edi_jorels is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with l10n_co_edi_jorels.  If not, see <https://www.gnu.org/licenses/>.
+#
+# email: info@jorels.com
+#
+
+import logging
+import threading
+
+from odoo import api, fields, models
+
+_logger = logging.getLogger(__name__)
+
+
+class Submission(models.Model):
+    _name = "l10n_co_edi_jorels.submission"
+    _description = "Cola de envíos a la DIAN"
+    _order = "id desc"
+
+    invoice_id = fields.Many2one(comodel_name='account.invoice', string="Documento", required=True, readonly=True,
+                                 index=True, ondelete='cascade')
+    company_id = fields.Many2one(related='invoice_id.company_id', string="Compañía", store=True, readonly=True)
+    user_id = fields.Many2one(comodel_name='res.users', string="Usuario", required=True, readonly=True,
+                              default=lambda self: self.env.user, ondelete='cascade')
+    state = fields.Selection([
+        ('pending', 'Pendiente'),
+        ('done', 'Enviado'),
+        ('error', 'Error'),
+    ], string="Estado", default='pending', required=True, readonly=True, index=True)
+    attempts = fields.Integer(string="Intentos", readonly=True)
+    message = fields.Text(string="Mensaje", readonly=True)
+    date_done = fields.Datetime(string="Fecha de envío", readonly=True)
+
+    @api.model
+    def enqueue(self, invoices):
+        """Add the invoices to the queue, unless they are already waiting in it"""
+        queued = self.sudo().search([('invoice_id', 'in', invoices.ids), ('state', '=', 'pending')])
+        to_queue = invoices - queued.mapped('invoice_id')
+        for invoice in to_queue:
+            self.sudo().create({'invoice_id': invoice.id, 'user_id': self.env.user.id})
+        return to_queue
+
+    @api.multi
+    def action_retry(self):
+        self.filtered(lambda entry: entry.state == 'error').write({'state': 'pending'})
+
+    @api.model
+    def _cron_process_queue(self, batch_size=200):
+        """Send the pending documents to the DIAN.
+
+        The entries are locked with SKIP LOCKED, so several workers can drain the queue at the same time. Each
+        batch is committed on its own and its documents are sent concurrently with validate_dian_batch.
+        """
+        auto_commit = not getattr(threading.currentThread(), 'testing', False)
+        while True:
+            self.env.cr.execute("""
+                SELECT id FROM l10n_co_edi_jorels_submission
+                WHERE state = 'pending'
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            """, (batch_size,))
+            entries = self.browse([row[0] for row in self.env.cr.fetchall()])
+            if not entries:
+                break
+
+            parked = entries._process()
+            if auto_commit:
+                self.env.cr.commit()
+            # Con la API caída se espera a la siguiente ejecución
+            if parked or not auto_commit:
+                break
+
+    @api.multi
+    def _process(self):
+        """Validate the documents of the entries, return True if some of them were left pending because the API
+        is not available"""
+        parked = False
+        # Las facturas se validan con el usuario que las confirmó, pues la compañía de este define la API
+        for user in self.mapped('user_id'):
+            user_entries = self.filtered(lambda entry: entry.user_id == user)
+            invoices = user_entries.mapped('invoice_id').sudo(user)
+            try:
+                with self.env.cr.savepoint():
+                    summary = invoices.action_validate_dian_batch()
+            except Exception as e:
+                _logger.error("Error al procesar la cola de envíos: %s", e)
+                summary = {invoice_id: {'success': False, 'message': str(e)} for invoice_id in invoices.ids}
+
+            to_send = invoices.filtered(
+                lambda inv: inv.id in summary and summary[inv.id]['success'] and inv.ei_is_not_test)
+            if to_send and user.company_id.enable_mass_send_print:
+                self.env['l10n_co_edi_jorels.mail_submission'].sudo(user).enqueue(to_send)
+
+            for entry in user_entries:
+                result = summary.get(entry.invoice_id.id)
+                if result is not None and result.get('unavailable'):
+                    parked = True
+                    entry.write({
+                        'attempts': entry.attempts + 1,
+                        'message': result['message'],
+                    })
+                elif result is None:
+                    entry.write({
+                        'state': 'done',
+                        'attempts': entry.attempts + 1,
+                        'message': "El documento ya no estaba pendiente de validación",
+                        'date_done': fields.Datetime.now(),
+                    })
+                elif result['success']:
+                    entry.write({
+                        'state': 'done',
+                        'attempts': entry.attempts + 1,
+                        'message': result['message'],
+                        'date_done': fields.Datetime.now(),
+                    })
+                else:
+                    entry.write({
+                        'state': 'error',
+                        'attempts': entry.attempts + 1,
+                        'message': result['message'],
+                    })
+
+        return parked
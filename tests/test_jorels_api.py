@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+#
+# Jorels S.A.S. - Copyright (2019-2021)
+#
+# This file is part of l10n_co_edi_jorels.
+#
+# l10n_co_edi_jorels is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# l10n_co_edi_jorels is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with l10n_co_edi_jorels.  If not, see <https://www.gnu.org/licenses/>.
+#
+# email: info@jorels.com
+#
+
+from unittest import mock
+
+import requests
+from urllib3.exceptions import NewConnectionError, ProtocolError
+
+from odoo.tests import common
+
+from ..tools import jorels_api
+
+
+class TestJorelsApiClient(common.BaseCase):
+
+    def setUp(self):
+        super(TestJorelsApiClient, self).setUp()
+        self.client = jorels_api.JorelsApiClient('http://api.test')
+        patcher = mock.patch.object(jorels_api.time, 'sleep')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _response(self, status_code, data=None):
+        response = mock.Mock(status_code=status_code, headers={})
+        response.json.return_value = data if data is not None else {}
+        return response
+
+    def _open_circuit(self):
+        self.client.breaker.failures = jorels_api.FAILURE_THRESHOLD
+        self.client.breaker.opened_at = 0
+
+    def test_probe_error_releases_circuit(self):
+        """A probe failing with a non-connection error opens the circuit again, it doesn't stay probing"""
+        self._open_circuit()
+        with mock.patch.object(self.client.session, 'request',
+                               side_effect=requests.exceptions.ChunkedEncodingError()):
+            with self.assertRaises(requests.exceptions.ChunkedEncodingError):
+                self.client.get('/api/ubl2.1/config/resolutions', 'token')
+        self.assertFalse(self.client.breaker._probing)
+
+        # Pasado el tiempo de espera se deja pasar una nueva prueba
+        self.client.breaker.opened_at = 0
+        with mock.patch.object(self.client.session, 'request', return_value=self._response(200, [])):
+            self.assertEqual(self.client.get('/api/ubl2.1/config/resolutions', 'token'), [])
+        self.assertTrue(self.client.is_available())
+
+    def test_post_not_retried_after_sending(self):
+        error = requests.ConnectionError(ProtocolError('Connection aborted.'))
+        with mock.patch.object(self.client.session, 'request', side_effect=error) as request:
+            with self.assertRaises(requests.ConnectionError) as raised:
+                self.client.post('/api/ubl2.1/invoice', 'token', {})
+        self.assertEqual(request.call_count, 1)
+        self.assertTrue(jorels_api.is_ambiguous_error(raised.exception))
+        self.assertFalse(jorels_api.is_unavailable_error(raised.exception))
+
+    def test_post_retried_when_not_sent(self):
+        error = requests.ConnectionError(mock.Mock(reason=NewConnectionError(None, 'Connection refused')))
+        with mock.patch.object(self.client.session, 'request',
+                               side_effect=[error, self._response(200, {'is_valid': True})]) as request:
+            self.assertEqual(self.client.post('/api/ubl2.1/invoice', 'token', {}), {'is_valid': True})
+        self.assertEqual(request.call_count, 2)
+
+    def test_retryable_status_exhausted(self):
+        response = self._response(503)
+        response.json.side_effect = ValueError("<html>Service Unavailable</html>")
+        with mock.patch.object(self.client.session, 'request', return_value=response) as request:
+            with self.assertRaises(jorels_api.ApiUnavailable) as raised:
+                self.client.post('/api/ubl2.1/invoice', 'token', {})
+        self.assertEqual(request.call_count, jorels_api.MAX_RETRIES + 1)
+        self.assertTrue(jorels_api.is_unavailable_error(raised.exception))
+        self.assertEqual(self.client.breaker.failures, 1)
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+#
+# Jorels S.A.S. - Copyright (2019-2021)
+#
+# This file is part of l10n_co_edi_jorels.
+#
+# l10n_co_edi_jorels is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# l10n_co_edi_jorels is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with l10n_co_edi_jorels.  If not, see <https://www.gnu.org/licenses/>.
+#
+# email: info@jorels.com
+#
+
+import copy
+import json
+import logging
+import random
+import re
+import threading
+import time
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+_logger = logging.getLogger(__name__)
+
+# Segundos para establecer la conexión y para esperar la respuesta.
+# La DIAN puede tardar en responder los envíos sincronos, por eso la lectura es mas larga.
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 120
+
+# Conexiones keep-alive que se mantienen abiertas por cada url de la API
+POOL_MAXSIZE = 32
+
+# Reintentos ante errores transitorios, con espera exponencial y aleatoria entre ellos (segundos)
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8
+# Un 429 o un 503 indican que la petición no se procesó, se reintentan en cualquier método
+RETRY_STATUS = (429, 503)
+# Otro 5xx o una respuesta que no llegó pueden significar que el documento sí se procesó, por eso solo se
+# reintentan en los métodos idempotentes. Un POST solo se reintenta si no se llegó a enviar; si no, falla y el
+# documento queda para revisión manual, pues reenviarlo podría duplicarlo en la DIAN
+IDEMPOTENT_METHODS = ('GET', 'PUT', 'DELETE')
+
+# Fallos consecutivos tras los que se deja de llamar a la API, y segundos antes de volver a probar
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 60
+
+# Ids, uuids y TestSetId en las rutas, se agrupan para las estadisticas de latencia
+_PATH_ID = re.compile(r'/(\d+|[^/]{20,})(?=/|$)')
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+# Plantillas de las peticiones, se leen una sola vez por proceso
+_API_TEMPLATES_PATH = Path(__file__).parents[1] / 'static' / 'api.json'
+_api_templates = None
+
+
+class ApiUnavailable(Exception):
+    """The API url is not available: the circuit breaker is open or it kept answering 429/5xx, the request was
+    not processed"""
+
+
+def _is_not_sent(error):
+    """True if the request failed before being sent: connect timeout or connection refused"""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def is_unavailable_error(error):
+    """True if the request surely didn't reach the API, the document can stay in the queue to be sent later"""
+    return isinstance(error, ApiUnavailable) or (
+        isinstance(error, requests.ConnectionError) and _is_not_sent(error))
+
+
+def is_ambiguous_error(error):
+    """True if the request was sent but no response arrived, the API may have processed the document"""
+    return isinstance(error, (requests.ConnectionError, requests.Timeout)) and not _is_not_sent(error)
+
+
+class CircuitBreaker(object):
+    """Stop calling an API url after several consecutive failures.
+
+    Once open, requests fail fast until reset_timeout seconds have passed. Then a single request is let through:
+    its result closes the circuit or opens it again.
+    """
+
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if not self._probing and time.time() - self.opened_at >= self.reset_timeout:
+                self._probing = True
+                return True
+            return False
+
+    def is_open(self):
+        with self._lock:
+            if self.opened_at is None:
+                return False
+            return self._probing or time.time() - self.opened_at < self.reset_timeout
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.time()
+
+
+class JorelsApiClient(object):
+    """HTTP client for one API url.
+
+    It keeps a pool of keep-alive connections shared by all the threads of the process, enforces connect and
+    read timeouts and records the latency of each endpoint. Transient errors are retried with exponential backoff
+    and jitter: any failure of GET, PUT and DELETE, but a POST only when it was not sent or got a 429 or 503.
+    A circuit breaker fails fast while the API is down.
+    """
+
+    def __init__(self, api_url, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), pool_maxsize=POOL_MAXSIZE):
+        self.api_url = api_url
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.breaker = CircuitBreaker()
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    def is_available(self):
+        """False while the circuit breaker is open"""
+        return not self.breaker.is_open()
+
+    def request(self, method, path, token, data=None):
+        """Send a request to the API and return the json response.
+
+        :param method: 'GET', 'POST', 'PUT' or 'DELETE'
+        :param path: endpoint path, e.g. '/api/ubl2.1/invoice'
+        :param token: API key of the company
+        :param data: json serializable body, if any
+        :raise ApiUnavailable: if the circuit breaker is open or the API kept answering 429/503 (any 5xx for
+            the idempotent methods)
+        """
+        header = {
+            "accept": "application/json",
+            "Content-Type": "application/json",
+            "Authorization": "Bearer " + token
+        }
+        body = json.dumps(data) if data is not None else None
+        endpoint = method + ' ' + _PATH_ID.sub('/{id}', path)
+
+        if not self.breaker.allow_request():
+            raise ApiUnavailable("La API %s no está disponible, intente más tarde" % self.api_url)
+
+        # Cualquier error, también un json inválido o un ChunkedEncodingError, cuenta como fallo del circuito y
+        # libera la petición de prueba cuando está medio abierto
+        try:
+            response = self._send_with_retries(method, path, body, header, endpoint)
+            result = response.json()
+        except BaseException:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return result
+
+    def _send_with_retries(self, method, path, body, header, endpoint):
+        """Send the request, retrying the transient errors, and return the response.
+
+        :raise ApiUnavailable: if the API kept answering a retryable status
+        """
+        attempt = 0
+        while True:
+            response = None
+            start = time.time()
+            try:
+                response = self.session.request(method, self.api_url + path, data=body, headers=header,
+                                                timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._record_latency(endpoint, time.time() - start)
+                retry = method in IDEMPOTENT_METHODS or _is_not_sent(e)
+                if not retry or attempt >= MAX_RETRIES:
+                    raise
+                _logger.info("API %s: %s. Reintento %s", endpoint, e, attempt + 1)
+            else:
+                self._record_latency(endpoint, time.time() - start)
+                retry = response.status_code in RETRY_STATUS or (
+                        response.status_code >= 500 and method in IDEMPOTENT_METHODS)
+                if not retry:
+                    return response
+                if attempt >= MAX_RETRIES:
+                    raise ApiUnavailable("La API %s respondió HTTP %s, intente más tarde" % (
+                        self.api_url, response.status_code))
+                _logger.info("API %s: HTTP %s. Reintento %s", endpoint, response.status_code, attempt + 1)
+
+            time.sleep(self._backoff(attempt, response))
+            attempt += 1
+
+    @staticmethod
+    def _backoff(attempt, response=None):
+        # Se respeta el Retry-After de un 429, si lo hay
+        if response is not None and response.headers.get('Retry-After', '').isdigit():
+            return min(int(response.headers['Retry-After']), BACKOFF_MAX)
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+    def get(self, path, token):
+        return self.request('GET', path, token)
+
+    def post(self, path, token, data):
+        return self.request('POST', path, token, data)
+
+    def put(self, path, token, data):
+        return self.request('PUT', path, token, data)
+
+    def delete(self, path, token):
+        return self.request('DELETE', path, token)
+
+    def _record_latency(self, endpoint, elapsed):
+        with self._stats_lock:
+            stats = self._stats.setdefault(endpoint, {'count': 0, 'total': 0.0, 'max': 0.0})
+            stats['count'] += 1
+            stats['total'] += elapsed
+            stats['max'] = max(stats['max'], elapsed)
+        _logger.debug("API %s%s: %.3fs", self.api_url, endpoint, elapsed)
+
+    def get_stats(self):
+        """Return {endpoint: {'count', 'total', 'max', 'avg'}} with the latencies in seconds"""
+        with self._stats_lock:
+            return {
+                endpoint: dict(stats, avg=stats['total'] / stats['count'])
+                for endpoint, stats in self._stats.items()
+            }
+
+
+def is_available(api_url):
+    """False while the API url is failing and its requests are refused"""
+    return get_client(api_url).is_available() if api_url else True
+
+
+def get_client(api_url):
+    """Return the client shared by the process for this API url"""
+    api_url = api_url.rstrip('/')
+    client = _clients.get(api_url)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(api_url)
+            if client is None:
+                client = _clients[api_url] = JorelsApiClient(api_url)
+    return client
+
+
+def get_request_template(name):
+    """Return a copy of the request template of static/api.json, e.g. 'resolucion' or 'environment'.
+
+    The file is parsed once per process, each caller gets its own copy to fill in.
+    """
+    global _api_templates
+    if _api_templates is None:
+        with open(_API_TEMPLATES_PATH) as api_file:
+            _api_templates = json.loads(api_file.read())
+    return copy.deepcopy(_api_templates[name])